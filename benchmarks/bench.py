@@ -0,0 +1,246 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# Times the stages of building a daily report on synthetic detailed
+# billing reports of increasing size:
+#
+#     python benchmarks/bench.py --rows 10000 100000 1000000
+#     python benchmarks/bench.py --save baseline.json
+#     python benchmarks/bench.py --compare baseline.json
+#
+# Every size is run in a fresh process so the peak memory reported for
+# it is not that of a larger size run before.
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import pytz
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dbrgen
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.dailyreport import AccountCollection, DailyReport
+from skinflint.dailyreport import create_account_page, create_summary_page
+from skinflint.filemanager import Engines
+
+SampleConfig = os.path.join(
+    os.path.dirname(__file__), '..', 'skinflint_sample.yml')
+
+Stages = ['generate', 'read', 'load', 'aggregate', 'accounts', 'report']
+
+# Stages that are not part of building a report and are not compared
+Untimed = ['generate']
+
+
+def peak_memory():
+    # The peak resident set size of this process in bytes
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+class Timer(object):
+
+    def __init__(self):
+        self.timings = {}
+
+    def time(self, stage, fn, *args, **kwargs):
+        start = time.time()
+        result = fn(*args, **kwargs)
+        self.timings[stage] = time.time() - start
+        return result
+
+
+def _read(path):
+    dbr = DetailedBillReportReader(path)
+    n = 0
+    for _ in dbr:
+        n += 1
+    return n
+
+
+def _load(path, engine, now):
+    ss = Engines[engine](now)
+    ss.load(DetailedBillReportReader(path))
+    return ss
+
+
+def _aggregate(ss):
+    return [ss.latest(), ss.one_day_ago(), ss.one_week_ago(),
+            ss.one_month_ago(), ss.this_month(), ss.last_month(),
+            ss.last_month_to_date()]
+
+
+def _report(config, account_collection, now):
+    report = DailyReport(config)
+    create_summary_page('Summary', report, account_collection)
+    all_accounts = list(config['accounts']) + ['AllAccounts']
+    for account_id in account_collection.totals:
+        create_account_page(
+            report, account_collection, account_id, all_accounts)
+    report.close()
+
+
+def run_size(args):
+    rows, options = args
+    tmp_dir = tempfile.mkdtemp(prefix='skinflint-bench-')
+    try:
+        path = os.path.join(tmp_dir, 'bench.csv')
+        start = datetime.datetime(2015, 2, 1)
+        now = pytz.utc.localize(
+            start + datetime.timedelta(hours=options['hours']))
+        timer = Timer()
+        timer.time('generate', dbrgen.generate_file, path, rows,
+                   accounts=options['accounts'],
+                   services=options['services'], hours=options['hours'],
+                   tags=options['tags'], start=start, seed=options['seed'])
+        timer.time('read', _read, path)
+        ss = timer.time('load', _load, path, options['engine'], now)
+        timer.time('aggregate', _aggregate, ss)
+        fp = open(SampleConfig)
+        config = yaml.safe_load(fp)
+        fp.close()
+        config['name'] = os.path.join(tmp_dir, 'DailyReport')
+        config['accounts'] = dict(
+            (account_id, {'name': 'Account%d' % i})
+            for i, account_id in enumerate(
+                dbrgen.account_ids(options['accounts'])))
+        account_collection = timer.time(
+            'accounts', AccountCollection, ss, config['accounts'])
+        timer.time('report', _report, config, account_collection, now)
+        return {'rows': rows,
+                'bytes': os.path.getsize(path),
+                'timings': timer.timings,
+                'rows_per_second': rows / max(timer.timings['load'], 1e-9),
+                'peak_memory': peak_memory()}
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def run(sizes, options):
+    results = []
+    for rows in sizes:
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply(run_size, ((rows, options),))
+        finally:
+            pool.close()
+            pool.join()
+        print_result(result)
+        results.append(result)
+    return {'options': options,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results}
+
+
+def print_result(result):
+    timings = ' '.join(['%s=%.3fs' % (stage, result['timings'][stage])
+                        for stage in Stages])
+    memory = ''
+    if result['peak_memory'] is not None:
+        memory = ' peak=%.1fMB' % (result['peak_memory'] / 1048576.0)
+    print('%10d rows %10.0f rows/s%s %s' % (
+        result['rows'], result['rows_per_second'], memory, timings))
+    sys.stdout.flush()
+
+
+def compare(baseline, current, tolerance):
+    # Returns a message for every stage of every size that got slower by
+    # more than tolerance, or used more than tolerance more memory.
+    regressions = []
+    old_results = dict((r['rows'], r) for r in baseline['results'])
+    for result in current['results']:
+        old = old_results.get(result['rows'])
+        if old is None:
+            continue
+        for stage in Stages:
+            if stage in Untimed or stage not in old['timings']:
+                continue
+            before = old['timings'][stage]
+            after = result['timings'][stage]
+            if after > before * (1 + tolerance):
+                regressions.append('%d rows: %s took %.3fs, was %.3fs' % (
+                    result['rows'], stage, after, before))
+        before = old.get('peak_memory')
+        after = result['peak_memory']
+        if before and after and after > before * (1 + tolerance):
+            regressions.append('%d rows: peak memory %.1fMB, was %.1fMB' % (
+                result['rows'], after / 1048576.0, before / 1048576.0))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark skinflint on synthetic billing reports')
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[10 ** 4, 10 ** 5])
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--services', type=int,
+                        default=len(dbrgen.Services))
+    parser.add_argument('--hours', type=int, default=24 * 40)
+    parser.add_argument('--tags', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--engine', choices=sorted(Engines),
+                        default='python')
+    parser.add_argument('--save', metavar='PATH',
+                        help='store the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare the results to a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='slowdown allowed before --compare fails')
+    args = parser.parse_args(args)
+    options = {'accounts': args.accounts, 'services': args.services,
+               'hours': args.hours, 'tags': args.tags, 'seed': args.seed,
+               'engine': args.engine}
+    results = run(args.rows, options)
+    if args.save:
+        fp = open(args.save, 'w')
+        try:
+            json.dump(results, fp, indent=2, sort_keys=True)
+        finally:
+            fp.close()
+    if args.compare:
+        fp = open(args.compare)
+        try:
+            baseline = json.load(fp)
+        finally:
+            fp.close()
+        if baseline['options'] != options:
+            print('baseline was run with other options: %s' %
+                  baseline['options'])
+        regressions = compare(baseline, results, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
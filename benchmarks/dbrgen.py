@@ -0,0 +1,166 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# Writes synthetic detailed billing reports.  The same arguments always
+# produce the same report, so timings taken on different machines or
+# commits are comparable.
+
+import argparse
+import csv
+import datetime
+import random
+import sys
+
+Headers = ['InvoiceID', 'PayerAccountId', 'LinkedAccountId', 'RecordType',
+           'RecordId', 'ProductName', 'RateId', 'SubscriptionId',
+           'PricingPlanId', 'UsageType', 'Operation', 'AvailabilityZone',
+           'ReservedInstance', 'ItemDescription', 'UsageStartDate',
+           'UsageEndDate', 'UsageQuantity', 'BlendedRate', 'BlendedCost',
+           'UnBlendedRate', 'UnBlendedCost', 'ResourceId']
+
+# (ProductName, UsageTypes, Operation) of the services in a report
+Services = [
+    ('Amazon Elastic Compute Cloud',
+     ['BoxUsage:m3.large', 'BoxUsage:c3.xlarge', 'BoxUsage:r3.2xlarge',
+      'BoxUsage', 'EBS:VolumeUsage.gp2', 'DataTransfer-Out-Bytes',
+      'DataTransfer-In-Bytes', 'DataTransfer-Regional-Bytes'],
+     'RunInstances'),
+    ('Amazon Simple Storage Service',
+     ['TimedStorage-ByteHrs', 'Requests-Tier1', 'Requests-Tier2',
+      'DataTransfer-Out-Bytes'],
+     'PutObject'),
+    ('Amazon DynamoDB',
+     ['ReadCapacityUnit-Hrs', 'WriteCapacityUnit-Hrs',
+      'TimedStorage-ByteHrs'],
+     'CommittedThroughput'),
+    ('Amazon Simple Queue Service',
+     ['Requests-Tier1', 'APS1-Requests-Tier1'],
+     'List'),
+    ('Amazon Simple Notification Service',
+     ['Requests-Tier1', 'DeliveryAttempts-HTTP'],
+     'Publish'),
+    ('Amazon RDS Service',
+     ['InstanceUsage:db.m3.large', 'RDS:GP2-Storage'],
+     'CreateDBInstance'),
+    ('Amazon ElastiCache',
+     ['NodeUsage:cache.m3.medium'],
+     'CreateCacheCluster'),
+    ('Amazon CloudFront',
+     ['US-DataTransfer-Out-Bytes', 'US-Requests-Tier1'],
+     'GET'),
+    ('Amazon SimpleDB',
+     ['BoxUsage', 'TimedStorage-ByteHrs'],
+     'Select'),
+    ('Amazon Route 53',
+     ['HostedZone', 'DNS-Queries'],
+     'Query'),
+]
+
+Zones = ['us-east-1a', 'us-east-1b', 'us-east-1d', 'us-west-2a', '']
+
+TimeFormat = '%Y-%m-%d %H:%M:%S'
+
+
+def report_headers(tags=0):
+    return Headers + ['user:Tag%d' % i for i in range(0, tags)]
+
+
+def account_ids(accounts):
+    return ['%012d' % (100000000000 + i * 7919) for i in range(0, accounts)]
+
+
+def _cost(rnd):
+    return '%d.%08d' % (rnd.randint(0, 4), rnd.randint(0, 10 ** 8 - 1))
+
+
+def generate(fp, rows, accounts=10, services=len(Services), hours=24 * 40,
+             tags=0, start=datetime.datetime(2015, 2, 1), seed=42):
+    # Writes about rows line items spread evenly over hours hours from
+    # start.  About one row in twenty is followed by a RateId 0 row, a
+    # few rows are one-time charges with no usage type and the report
+    # ends with the totals rows that have no usage period.
+    rnd = random.Random(seed)
+    writer = csv.writer(fp, quoting=csv.QUOTE_ALL, lineterminator='\n')
+    writer.writerow(report_headers(tags))
+    payer = '%012d' % 123456789012
+    linked_ids = account_ids(accounts)
+    products = Services[:max(1, min(services, len(Services)))]
+    tag_values = ['value%d' % i for i in range(0, 20)] + ['']
+    record_id = 10 ** 25
+    written = 0
+    for hour in range(0, hours):
+        usage_start = start + datetime.timedelta(hours=hour)
+        usage_end = usage_start + datetime.timedelta(hours=1)
+        usage_start = usage_start.strftime(TimeFormat)
+        usage_end = usage_end.strftime(TimeFormat)
+        hour_rows = (rows * (hour + 1)) // hours - written
+        written += hour_rows
+        n = 0
+        while n < hour_rows:
+            product_name, usage_types, operation = rnd.choice(products)
+            usage_type = rnd.choice(usage_types)
+            if rnd.random() < 0.001:
+                usage_type = ''
+            rate_id = str(rnd.randint(1, 10 ** 7))
+            if n > 0 and rnd.random() < 0.05:
+                rate_id = '0'
+            cost = _cost(rnd)
+            record_id += 1
+            row = ['Estimated', payer, rnd.choice(linked_ids), 'LineItem',
+                   str(record_id), product_name, rate_id,
+                   str(rnd.randint(1, 10 ** 8)), str(rnd.randint(1, 10 ** 6)),
+                   usage_type, operation, rnd.choice(Zones), 'N',
+                   '%s %s' % (product_name, usage_type),
+                   usage_start, usage_end, '%d.00000000' % rnd.randint(1, 99),
+                   '0.0100000000', cost, '0.0100000000', cost,
+                   'i-%08x' % rnd.randint(0, 2 ** 32 - 1)]
+            row.extend([rnd.choice(tag_values) for _ in range(0, tags)])
+            writer.writerow(row)
+            n += 1
+    for account_id in linked_ids:
+        row = ['Estimated', payer, account_id, 'AccountTotal', '', '', '',
+               '', '', '', '', '', '', 'Total for linked account',
+               '', '', '', '', '0.00000000', '', '0.00000000', '']
+        row.extend([''] * tags)
+        writer.writerow(row)
+
+
+def generate_file(path, rows, **kwargs):
+    if sys.version_info[0] >= 3:
+        fp = open(path, 'w', newline='')
+    else:
+        fp = open(path, 'wb')
+    try:
+        generate(fp, rows, **kwargs)
+    finally:
+        fp.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic detailed billing report')
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=10 ** 5)
+    parser.add_argument('--accounts', type=int, default=10)
+    parser.add_argument('--services', type=int, default=len(Services))
+    parser.add_argument('--hours', type=int, default=24 * 40)
+    parser.add_argument('--tags', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(args)
+    generate_file(args.path, args.rows, accounts=args.accounts,
+                  services=args.services, hours=args.hours, tags=args.tags,
+                  seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,7 @@ setup(
     package_data={'skinflint': ['_version']},
     package_dir={'skinflint': 'skinflint'},
     install_requires=requires,
+    extras_require={'columnar': ['numpy']},
     license=open("LICENSE").read(),
     classifiers=(
         'Development Status :: 3 - Alpha',
@@ -13,36 +13,241 @@
 
 import csv
 import decimal
+import io
+import itertools
+import operator
+import os
+import sys
+import zipfile
+
+from skinflint import stats
+from skinflint.metric import to_fixed
+
+
+class LineItem(object):
+
+    # The values stay in the list produced by the CSV reader and are
+    # looked up through a column index shared by every row of the
+    # report, so no per-row dict is ever built.
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, name):
+        return self._values[self._index[name]]
+
+    def __setitem__(self, name, value):
+        self._values[self._index[name]] = value
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return 'LineItem(%r)' % self.as_dict()
+
+    def get(self, name, default=None):
+        if name in self._index:
+            return self._values[self._index[name]]
+        return default
+
+    def keys(self):
+        return self._index.keys()
+
+    def as_dict(self):
+        return {name: self._values[i] for name, i in self._index.items()}
+
+
+def open_report_bytes(filepath):
+    # Reports can be read straight out of the zip file they are
+    # delivered in, which keeps the cached copy at its compressed size.
+    if not filepath.endswith('.zip'):
+        return open(filepath, 'rb')
+    zf = zipfile.ZipFile(filepath)
+    member = zf.open(zf.namelist()[0])
+    zf.close()
+    return member
+
+
+def report_size(filepath):
+    if not filepath.endswith('.zip'):
+        return os.path.getsize(filepath)
+    zf = zipfile.ZipFile(filepath)
+    size = zf.infolist()[0].file_size
+    zf.close()
+    return size
+
+
+class _ByteRange(io.RawIOBase):
+
+    # Limits reads from fp to the next length bytes.
+
+    def __init__(self, fp, length):
+        self._fp = fp
+        self._remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        n = min(len(buf), self._remaining)
+        if n <= 0:
+            return 0
+        data = self._fp.read(n)
+        buf[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self._fp.close()
+        super(_ByteRange, self).close()
+
+
+def open_report(filepath, offset=0, end=None):
+    # offset and end are byte offsets into the (uncompressed) report and
+    # must fall on the start of a line.
+    fp = open_report_bytes(filepath)
+    if offset:
+        if filepath.endswith('.zip'):
+            remaining = offset
+            while remaining > 0:
+                chunk = fp.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+        else:
+            fp.seek(offset)
+    if end is not None:
+        fp = io.BufferedReader(_ByteRange(fp, end - offset))
+    if sys.version_info[0] < 3:
+        return fp
+    return io.TextIOWrapper(fp, encoding='utf-8', newline='')
 
 
 class ReportReader(object):
 
     KeyName = ''
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, columns=None, offset=0, end=None):
         self.filepath = filepath
-        self._fp = open(filepath)
+        self._fp = open_report(filepath)
         self._reader = csv.reader(self._fp)
         self.headers = []
         while len(self.headers) <= 1:
             self.headers = next(self._reader)
+        if offset or end is not None:
+            # Only read the rows from offset on (up to end), e.g. the part
+            # of a report that was appended since it was last read.
+            self._fp.close()
+            self._fp = open_report(filepath, offset, end)
+            self._reader = csv.reader(self._fp)
+        self.index = {}
+        for i in range(0, len(self.headers)):
+            self.index[self.headers[i]] = i
+        self.columns = None
+        self.fixed_point = False
+        self._getter = None
+        self._row_index = self.index
+        self._rows = 0
+        self._counted = False
+        if columns is not None:
+            self.project(columns)
+
+    def project(self, columns):
+        # Only keep the named columns in each LineItem.  Columns that
+        # are not in the report are ignored, the rest are stored (and
+        # converted by _computed_data) in the order of the report.
+        wanted = set(columns)
+        self.columns = [h for h in self.headers if h in wanted]
+        positions = [self.index[c] for c in self.columns]
+        self._row_index = {}
+        for i in range(0, len(self.columns)):
+            self._row_index[self.columns[i]] = i
+        if len(positions) == 1:
+            position = positions[0]
+            self._getter = lambda line: [line[position]]
+        elif positions:
+            getter = operator.itemgetter(*positions)
+            self._getter = lambda line: list(getter(line))
+        else:
+            self._getter = lambda line: []
+
+    def _add_column(self, name):
+        if name not in self.index:
+            self.index[name] = len(self.headers)
+            self.headers.append(name)
 
     def _computed_data(self, data):
         pass
 
     def __next__(self):
-        line = next(self._reader)
-        data = {}
-        for i in range(0, len(self.headers)):
-            data[self.headers[i]] = line[i]
+        try:
+            line = next(self._reader)
+            while not line:
+                line = next(self._reader)
+        except StopIteration:
+            self._finished()
+            raise
+        missing = len(self.headers) - len(line)
+        if missing > 0:
+            line.extend([''] * missing)
+        self._rows += 1
+        if self._getter is not None:
+            line = self._getter(line)
+        data = LineItem(self._row_index, line)
         self._computed_data(data)
         return data
 
     next = __next__
 
+    def iter_columns(self, columns, chunk_size=16384):
+        # Yields the values of the named columns of up to chunk_size of
+        # the remaining rows at a time, as a sequence per column.  The
+        # rows are not turned into LineItems and _computed_data is not
+        # applied, so the values are the strings in the report.
+        positions = [self.index[c] for c in columns]
+        getter = operator.itemgetter(*positions)
+        width = max(positions) + 1
+
+        def pad(line):
+            return line + [''] * (width - len(line))
+
+        rows = (getter(line if len(line) >= width else pad(line))
+                for line in self._reader if line)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            self._rows += len(chunk)
+            if len(positions) == 1:
+                yield [chunk]
+            else:
+                yield list(zip(*chunk))
+        self._finished()
+
+    def _finished(self):
+        # Counted once at the end of the report rather than per row.  The
+        # rows are the non-blank rows after the header, also for a reader
+        # of a byte range, so the counts of the ranges of a report add
+        # up to the count of the whole report.
+        if not self._counted:
+            self._counted = True
+            stats.incr('reader.rows', self._rows)
+            stats.incr('reader.reports')
+
     def __iter__(self):
         return self
 
+    def close(self):
+        self._fp.close()
+
 
 class DetailedBillReportReader(ReportReader):
 
@@ -50,8 +255,16 @@ class DetailedBillReportReader(ReportReader):
                'and-tags-{year}-{month:02d}.csv.zip')
 
     def _computed_data(self, data):
-        data['UnBlendedCost'] = decimal.Decimal(data['UnBlendedCost'])
-        data['BlendedCost'] = decimal.Decimal(data['BlendedCost'])
+        # In fixed_point mode costs become ints in the units used by
+        # skinflint.metric rather than Decimals.
+        if self.fixed_point:
+            convert = to_fixed
+        else:
+            convert = decimal.Decimal
+        if 'UnBlendedCost' in data:
+            data['UnBlendedCost'] = convert(data['UnBlendedCost'])
+        if 'BlendedCost' in data:
+            data['BlendedCost'] = convert(data['BlendedCost'])
 
 
 class MonthlyReportReader(ReportReader):
@@ -59,6 +272,8 @@ class MonthlyReportReader(ReportReader):
     KeyName = '{id}-aws-billing-csv-{year}-{month:02d}.csv'
 
     def _computed_data(self, data):
+        if 'TotalCost' not in data:
+            return
         if data['TotalCost'] == '':
             data['TotalCost'] = '0'
         data['TotalCost'] = decimal.Decimal(data['TotalCost'])
@@ -68,7 +283,16 @@ class MonthlyCostAllocationReportReader(ReportReader):
 
     KeyName = '{id}-aws-cost-allocation-{year}-{month:02d}.csv'
 
+    def __init__(self, filepath, columns=None, offset=0, end=None):
+        super(MonthlyCostAllocationReportReader, self).__init__(
+            filepath, offset=offset, end=end)
+        self._add_column('TotalCost')
+        if columns is not None:
+            self.project(columns)
+
     def _computed_data(self, data):
-        if 'TotalCost' not in data or data['TotalCost'] == '':
+        if 'TotalCost' not in data:
+            return
+        if data['TotalCost'] == '':
             data['TotalCost'] = '0'
         data['TotalCost'] = decimal.Decimal(data['TotalCost'])
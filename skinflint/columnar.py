@@ -0,0 +1,226 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from skinflint import stats
+from skinflint.billreader import ReportReader
+from skinflint.metric import FixedPointScale, to_fixed
+from skinflint.slice import Metrics, Slice, SuperSlice
+
+CostColumn = 'BlendedCost'
+PeriodColumns = ('UsageStartDate', 'UsageEndDate')
+
+# Rows are read and coded ChunkSize at a time, so the values of a whole
+# report are never held in memory.
+ChunkSize = 16384
+
+# Costs from a float conversion are only trusted below this many
+# dollars, where a float still has room for the 8 decimal places.
+FloatCostLimit = 10 ** 7
+
+
+def fixed_costs(values):
+    # The fixed point costs of a sequence of cost strings.  They are
+    # converted as floats in one go and the few whose float was not
+    # exact (more than 8 decimal places or too large) are converted
+    # again one by one.
+    floats = numpy.fromiter(map(float, values), numpy.float64, len(values))
+    costs = numpy.rint(floats * FixedPointScale).astype(numpy.int64)
+    inexact = ((costs / float(FixedPointScale) != floats) |
+               (numpy.abs(floats) >= FloatCostLimit))
+    for i in numpy.flatnonzero(inexact).tolist():
+        costs[i] = to_fixed(values[i])
+    return costs
+
+
+class _Codes(object):
+
+    # Dense integer codes for tuples of values, shared by all of the
+    # chunks of a load.  The values of a column are coded through a
+    # dict that only the distinct values of a chunk are added to, and
+    # the rows of column codes are then coded with numpy.unique.
+
+    def __init__(self, ncolumns):
+        self._column_codes = [{} for _ in range(0, ncolumns)]
+        self._column_values = [[] for _ in range(0, ncolumns)]
+        self._codes = {}
+        # The tuple of values of every code
+        self.values = []
+
+    def _encode_column(self, i, column):
+        codes = self._column_codes[i]
+        for value in dict.fromkeys(column):
+            if value not in codes:
+                codes[value] = len(codes)
+                self._column_values[i].append(value)
+        return numpy.fromiter(map(codes.__getitem__, column), numpy.int64,
+                              len(column))
+
+    def _code(self, column_codes):
+        code = self._codes.get(column_codes)
+        if code is None:
+            code = len(self.values)
+            self._codes[column_codes] = code
+            self.values.append(tuple(
+                [self._column_values[i][c]
+                 for i, c in enumerate(column_codes)]))
+        return code
+
+    def encode(self, columns):
+        coded = []
+        combined = numpy.zeros(len(columns[0]), dtype=numpy.int64)
+        for i, column in enumerate(columns):
+            column_codes = self._encode_column(i, column)
+            coded.append(column_codes)
+            combined *= len(self._column_codes[i])
+            combined += column_codes
+            # Kept below the number of rows so that it cannot overflow
+            _, combined = numpy.unique(combined, return_inverse=True)
+            combined = combined.reshape(-1)
+        _, first, inverse = numpy.unique(
+            combined, return_index=True, return_inverse=True)
+        rows = numpy.column_stack(coded)[first].tolist()
+        codes = numpy.array([self._code(tuple(row)) for row in rows],
+                            dtype=numpy.int64)
+        return codes[inverse.reshape(-1)]
+
+
+def _iter_columns(rows, columns, chunk_size):
+    # ReportReader.iter_columns for any iterable of dict like rows
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield [[row[c] for row in chunk] for c in columns]
+
+
+class ColumnarSuperSlice(SuperSlice):
+
+    # A SuperSlice that loads reports column by column.  The rows of a
+    # report are read in chunks without being turned into LineItems,
+    # and the columns of a chunk become numpy arrays of an hour code, a
+    # code for the combination of columns the metric keys are made
+    # from (account, product and usage type) and a fixed point cost.
+    # The costs are then summed per (hour, combination) and the metric
+    # keys are computed once per combination instead of once per row.
+    # The result is the same as that of SuperSlice.load, so everything
+    # else is shared with it.
+
+    def __init__(self, now=None):
+        if numpy is None:
+            raise ImportError('ColumnarSuperSlice requires numpy')
+        super(ColumnarSuperSlice, self).__init__(now)
+
+    def _key_columns(self):
+        columns = []
+        for metric_cls in Metrics:
+            for column in metric_cls.Columns:
+                if column != CostColumn and column not in columns:
+                    columns.append(column)
+        return columns
+
+    def load(self, billreader, source=None):
+        source = self._prepare(billreader, source)
+        key_columns = self._key_columns()
+        columns = list(PeriodColumns) + ['RateId', CostColumn] + key_columns
+        if isinstance(billreader, ReportReader):
+            chunks = billreader.iter_columns(columns, ChunkSize)
+            convert = fixed_costs
+        else:
+            chunks = _iter_columns(billreader, columns, ChunkSize)
+            convert = self._fixed_costs
+        periods = _Codes(len(PeriodColumns))
+        groups = _Codes(len(key_columns))
+        period_codes = []
+        group_codes = []
+        costs = []
+        period_code = None
+        rows = 0
+        with stats.timer('superslice.load.rows'):
+            for chunk in chunks:
+                rows += len(chunk[0])
+                codes = self._period_codes(periods, chunk, period_code)
+                period_code = codes[-1]
+                period_codes.append(codes)
+                group_codes.append(groups.encode(chunk[4:]))
+                costs.append(convert(chunk[3]))
+        stats.incr('superslice.rows', rows)
+        with stats.timer('superslice.load.columns'):
+            slices = self._aggregate(periods.values, groups.values,
+                                     key_columns, period_codes,
+                                     group_codes, costs)
+        self._add_loaded(slices, source)
+
+    def _fixed_costs(self, values):
+        # Rows that are not from a ReportReader can have costs of any
+        # type to_fixed takes.
+        return numpy.array([to_fixed(v) for v in values],
+                           dtype=numpy.int64)
+
+    def _period_codes(self, periods, chunk, previous):
+        # Rows with a RateId of 0 belong to the period of the row before
+        # them, which for the first row of a chunk is the last row of
+        # the chunk before (previous).
+        nrows = len(chunk[2])
+        new = numpy.fromiter(map('0'.__ne__, chunk[2]), bool, nrows)
+        if previous is None:
+            new[0] = True
+        positions = numpy.flatnonzero(new)
+        if not len(positions):
+            return numpy.full(nrows, previous, dtype=numpy.int64)
+        columns = chunk[:2]
+        if len(positions) < nrows:
+            columns = [[column[i] for i in positions.tolist()]
+                       for column in columns]
+        codes = periods.encode(columns)
+        # The position in codes of the last new row at or before each row
+        last = numpy.cumsum(new) - 1
+        result = codes[numpy.maximum(last, 0)]
+        if previous is not None:
+            result[last < 0] = previous
+        return result
+
+    def _aggregate(self, periods, groups, key_columns, period_codes,
+                   group_codes, costs):
+        if not costs:
+            return []
+        combined = numpy.concatenate(period_codes) * len(groups)
+        combined += numpy.concatenate(group_codes)
+        order = numpy.argsort(combined, kind='mergesort')
+        combined = combined[order]
+        starts = numpy.concatenate(
+            ([0], numpy.flatnonzero(combined[1:] != combined[:-1]) + 1))
+        totals = numpy.add.reduceat(numpy.concatenate(costs)[order], starts)
+        combined = combined[starts]
+        # The metric keys of every combination of key columns
+        metrics = [metric_cls() for metric_cls in Metrics]
+        group_keys = []
+        for group in groups:
+            data = dict(zip(key_columns, group))
+            group_keys.append([m.keyfn(data) for m in metrics])
+        period_slices = [Slice(start, end) for start, end in periods]
+        ngroups = len(groups)
+        for code, total in zip(combined.tolist(), totals.tolist()):
+            period_code, group_code = divmod(code, ngroups)
+            new_slice = period_slices[period_code]
+            for metric, key in zip(new_slice.metrics, group_keys[group_code]):
+                if key is not None:
+                    metric.add_cost(key, total)
+        return period_slices
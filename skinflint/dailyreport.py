@@ -6,8 +6,12 @@ import pytz
 from xlsxwriter.utility import xl_rowcol_to_cell
 import yaml
 
+from skinflint import export
+from skinflint import pipeline
+from skinflint import stats
+from skinflint.billreader import DetailedBillReportReader
 from skinflint.filemanager import FileManager
-from skinflint.slice import SuperSlice
+from skinflint.slice import SuperSlice, previous_month
 from skinflint.report import Report
 
 
@@ -65,7 +69,7 @@ class DailyReport(Report):
                 fmt = None
             merge_range = header.get('range', None)
             if merge_range:
-                page.worksheet.merge_range(
+                page.merge_range(
                     row + merge_range[0][0], col + merge_range[0][1],
                     row + merge_range[1][0], col + merge_range[1][1],
                     header.get('label', ''),
@@ -90,7 +94,17 @@ class DailyReport(Report):
 
     thresholds = ((1, 500), (.005, .2))
 
-    def _create_conditional_formatting(self, fmt_type, page, row, col):
+    def __init__(self, config):
+        super(DailyReport, self).__init__(config)
+        # The cells of the current page that get conditional formats, as
+        # rows by (fmt_type, col), and the format options by fmt_type.
+        self._conditional_cells = {}
+        self._conditional_formats = {}
+
+    def _conditional_format_options(self, fmt_type):
+        options = self._conditional_formats.get(fmt_type)
+        if options is not None:
+            return options
         pos_big_format = self.get_format('{}_pos_big'.format(fmt_type))
         pos_small_format = self.get_format('{}_pos_small'.format(fmt_type))
         neg_big_format = self.get_format('{}_neg_big'.format(fmt_type))
@@ -99,23 +113,56 @@ class DailyReport(Report):
             thresh_low, thresh_high = self.thresholds[0]
         else:
             thresh_low, thresh_high = self.thresholds[1]
-        page.worksheet.conditional_format(
-            row, col, row, col, {'type': 'cell', 'criteria': 'between',
-                                 'minimum': thresh_low, 'maximum': thresh_high,
-                                 'format': pos_small_format})
-        page.worksheet.conditional_format(
-            row, col, row, col, {'type': 'cell', 'criteria': '>=',
-                                 'value': thresh_high,
-                                 'format': pos_big_format})
-        page.worksheet.conditional_format(
-            row, col, row, col, {'type': 'cell', 'criteria': 'between',
-                                 'minimum': -thresh_high,
-                                 'maximum': thresh_low,
-                                 'format': neg_small_format})
-        page.worksheet.conditional_format(
-            row, col, row, col, {'type': 'cell', 'criteria': '<=',
-                                 'value': -thresh_high,
-                                 'format': neg_big_format})
+        options = [
+            {'type': 'cell', 'criteria': 'between',
+             'minimum': thresh_low, 'maximum': thresh_high,
+             'format': pos_small_format},
+            {'type': 'cell', 'criteria': '>=',
+             'value': thresh_high,
+             'format': pos_big_format},
+            {'type': 'cell', 'criteria': 'between',
+             'minimum': -thresh_high,
+             'maximum': thresh_low,
+             'format': neg_small_format},
+            {'type': 'cell', 'criteria': '<=',
+             'value': -thresh_high,
+             'format': neg_big_format}]
+        self._conditional_formats[fmt_type] = options
+        return options
+
+    def _create_conditional_formatting(self, fmt_type, page, row, col):
+        # The formats are applied once per run of rows when the page is
+        # done, see _apply_conditional_formatting
+        if page.finished:
+            if page.buffered:
+                raise ValueError(
+                    'Page %s is already written out' % page.name)
+            # Nothing else will apply them
+            for option in self._conditional_format_options(fmt_type):
+                page.worksheet.conditional_format(row, col, row, col, option)
+            return
+        cells = self._conditional_cells.setdefault(page.name, {})
+        cells.setdefault((fmt_type, col), []).append(row)
+
+    def _apply_conditional_formatting(self, page):
+        cells = self._conditional_cells.pop(page.name, {})
+        for (fmt_type, col), rows in sorted(cells.items()):
+            options = self._conditional_format_options(fmt_type)
+            runs = []
+            for row in sorted(rows):
+                if runs and runs[-1][1] == row - 1:
+                    runs[-1][1] = row
+                else:
+                    runs.append([row, row])
+            for first_row, last_row in runs:
+                for option in options:
+                    page.worksheet.conditional_format(
+                        first_row, col, last_row, col, option)
+
+    def _finish_page(self):
+        if self._current_page is not None:
+            self._apply_conditional_formatting(self._current_page)
+        super(DailyReport, self)._finish_page()
 
     def write_service_data(self, worksheet_name, row, col, service_name, data):
         page = self.get_page(worksheet_name)
@@ -251,14 +298,8 @@ class AccountCollection(object):
     def __init__(self, superslice, account_map=None):
         self.superslice = superslice
         self.account_map = account_map or {}
-        self.data = {}
-        self.data['latest'] = self.superslice.latest()
-        self.data['one_day_ago'] = self.superslice.one_day_ago()
-        self.data['one_week_ago'] = self.superslice.one_week_ago()
-        self.data['one_month_ago'] = self.superslice.one_month_ago()
-        self.data['this_month'] = self.superslice.this_month()
-        self.data['last_month'] = self.superslice.last_month()
-        self.data['last_month_to_date'] = self.superslice.last_month_to_date()
+        self.data = self.superslice.aggregate_many(
+            self.superslice.report_windows())
         self.totals = {}
         self._create_accounts()
 
@@ -266,8 +307,9 @@ class AccountCollection(object):
         self.totals['AllAccounts'] = Account('AllAccounts')
         for time_frame in self.data:
             metric = self.data[time_frame].metrics[0]
-            for data_key in metric.data:
-                account_id, service, charge_type = data_key.split('|')
+            totals = metric.group_by('account', 'service', 'type')
+            for data_key in totals:
+                account_id, service, charge_type = data_key
                 if account_id not in self.totals:
                     if account_id in self.account_map:
                         account_name = self.account_map[account_id]['name']
@@ -276,9 +318,9 @@ class AccountCollection(object):
                     self.totals[account_id] = Account(
                         account_id, account_name)
                 self.totals[account_id].add(
-                    time_frame, service, charge_type, metric.data[data_key])
+                    time_frame, service, charge_type, totals[data_key])
                 self.totals['AllAccounts'].add(
-                    time_frame, service, charge_type, metric.data[data_key])
+                    time_frame, service, charge_type, totals[data_key])
 
 
 def create_summary_page(title, report, account_collection):
@@ -287,14 +329,9 @@ def create_summary_page(title, report, account_collection):
     report.create_headers(title, Header2, 2, 2)
     account_totals = {}
     for label in ['latest', 'one_day_ago', 'one_week_ago', 'one_month_ago']:
-        account_totals[label] = {}
         slice = account_collection.data[label]
         metric = slice.metrics[0]
-        accounts = metric.dimensions()['account']
-        for account in accounts:
-            account_costs = metric.query(account=account)
-            total = sum([v for v in account_costs.values()])
-            account_totals[label][account] = total
+        account_totals[label] = metric.group_by('account')
     latest_costs = [(k, v) for k, v in account_totals['latest'].items()]
     latest_costs.sort(key=lambda t: t[1], reverse=True)
     account_order = [t[0] for t in latest_costs]
@@ -362,6 +399,37 @@ def create_account_page(report, account_collection, account_id, all_accounts):
     report.write_monthly_totals(account, 1, 14)
 
 
+def report_requests(config, now):
+    # The (account_id, year, month) of the reports the daily report
+    # needs: this month and last month of every account with a bucket.
+    then = previous_month(now)
+    requests = []
+    for account_id in config['accounts']:
+        account_data = config['accounts'][account_id]
+        if 'bucket' in account_data:
+            requests.append((account_id, now.year, now.month))
+            requests.append((account_id, then.year, then.month))
+    return requests
+
+
+def load_detailed_billing_reports(config, now):
+    fm = FileManager(config)
+    requests = report_requests(config, now)
+    workers = config.get('workers', 1)
+    if workers <= 1 and fm.parse_workers > 1:
+        # One report at a time, each parsed in parse_workers processes.
+        # Those fork, so the downloads are all done first.
+        fm.fetch_many([(DetailedBillReportReader,) + request
+                       for request in requests])
+        ss = SuperSlice(now)
+        for account_id, year, month in requests:
+            ss.merge(fm.get_detailed_billing_superslice(
+                account_id, year, month, now))
+        return ss
+    return pipeline.load_reports(
+        fm, requests, now, workers, config.get('pipeline_queue_size'))
+
+
 def create_report(config_path, year=None, month=None, day=None):
     now = pytz.utc.localize(datetime.datetime.utcnow())
     if year and month and day:
@@ -373,28 +441,35 @@ def create_report(config_path, year=None, month=None, day=None):
     fp = open(config_path)
     config = yaml.load(fp)
     fp.close()
-    fm = FileManager(config)
-    ss = SuperSlice(now)
-    for account_id in config['accounts']:
-        account_data = config['accounts'][account_id]
-        if 'bucket' in account_data:
-            dbr = fm.get_detailed_billing_report_reader(
-                account_id, now.year, now.month)
-            ss.load(dbr)
-            dbr = fm.get_detailed_billing_report_reader(
-                account_id, now.year, now.month - 1)
-            ss.load(dbr)
-    account_collection = AccountCollection(ss, config['accounts'])
+    stats_file = config.get('stats_file')
+    if stats_file:
+        stats.enable()
+    with stats.timer('dailyreport.load'):
+        ss = load_detailed_billing_reports(config, now)
+    export_config = config.get('export')
+    if export_config:
+        with stats.timer('dailyreport.export'):
+            export.export(ss, export_config['path'],
+                          export_config.get('format', 'csv'),
+                          export_config.get('granularity', 'hour'))
+    with stats.timer('dailyreport.accounts'):
+        account_collection = AccountCollection(ss, config['accounts'])
     report = DailyReport(config)
 
-    # Write summary worksheet
-    month_name = calendar.month_abbr[now.month]
-    title = 'Summary-{} {} {}'.format(month_name, now.day, now.year)
-    create_summary_page(title, report, account_collection)
-
-    # Now write worksheets for each account
-    all_accounts = config['accounts'].keys() + ['AllAccounts']
-    for account_id in account_collection.totals:
-        create_account_page(
-            report, account_collection, account_id, all_accounts)
-    report.close()
+    with stats.timer('dailyreport.pages'):
+        # Write summary worksheet
+        month_name = calendar.month_abbr[now.month]
+        title = 'Summary-{} {} {}'.format(month_name, now.day, now.year)
+        create_summary_page(title, report, account_collection)
+
+        # Now write worksheets for each account
+        all_accounts = config['accounts'].keys() + ['AllAccounts']
+        for account_id in account_collection.totals:
+            create_account_page(
+                report, account_collection, account_id, all_accounts)
+    with stats.timer('dailyreport.close'):
+        report.close()
+    if stats_file:
+        fp = open(stats_file, 'w')
+        stats.dump(fp)
+        fp.close()
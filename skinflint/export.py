@@ -0,0 +1,217 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import calendar
+import csv
+import datetime
+import json
+import struct
+import sys
+
+from dateutil.tz import tzutc
+
+from skinflint.metric import to_decimal
+from skinflint.slice import Metrics
+
+# Exports the metric totals of a SuperSlice one record at a time, per
+# hour (every slice as loaded), per day or per named window.  A record
+# is a (window, start, end, metric, key, cost) tuple where window is the
+# name of the window ('' for hours and days), key is the tuple of
+# dimension values and cost is in fixed point.  Slices without a usage
+# period (the totals at the end of a report) are not exported.  The
+# records are written as they are produced, so the export as a whole is
+# never held in memory.
+
+Granularities = ('hour', 'day', 'window')
+
+CSVHeaders = ['window', 'start', 'end', 'metric', 'dimensions', 'key',
+              'cost']
+
+# The columnar format is a sequence of blocks of up to BlockSize records
+# after a header of ColumnarMagic and ColumnarVersion.  Each block holds
+# its record count, the strings first used in it (appended to a string
+# table shared by the whole file) and then its columns: start and end
+# as seconds since the epoch, the window, metric and key as indexes into
+# the string table and the cost in fixed point.  A block of 0 records
+# ends the file.  All numbers are little endian.
+ColumnarMagic = b'SKFC'
+ColumnarVersion = 1
+BlockSize = 65536
+_ColumnTypes = ('q', 'q', 'I', 'I', 'I', 'q')
+
+_UTC = tzutc()
+
+
+def _slices(superslice, granularity, windows=None):
+    # (window, slice) pairs in time order
+    if granularity in ('hour', 'day'):
+        for new_slice in superslice.timeline(granularity):
+            yield '', new_slice
+    elif granularity == 'window':
+        # By default the windows of the daily report
+        if windows is None:
+            windows = superslice.report_windows()
+        aggregates = superslice.aggregate_many(windows)
+        for name in sorted(aggregates):
+            yield name, aggregates[name]
+    else:
+        raise ValueError('Unknown granularity (%s)' % granularity)
+
+
+def records(superslice, granularity='hour', windows=None):
+    for name, new_slice in _slices(superslice, granularity, windows):
+        for metric in new_slice.metrics:
+            metric_name = metric.__class__.__name__
+            for key, cost in sorted(metric.items()):
+                yield (name, new_slice.start, new_slice.end, metric_name,
+                       key, cost)
+
+
+def _dimensions(metric_name):
+    for metric_cls in Metrics:
+        if metric_cls.__name__ == metric_name:
+            return metric_cls.Dimensions
+    return ''
+
+
+def write_csv(records, fp):
+    writer = csv.writer(fp, lineterminator='\n')
+    writer.writerow(CSVHeaders)
+    dimensions = {}
+    for window, start, end, metric_name, key, cost in records:
+        if metric_name not in dimensions:
+            dimensions[metric_name] = _dimensions(metric_name)
+        writer.writerow([window, start.isoformat(), end.isoformat(),
+                         metric_name, dimensions[metric_name],
+                         '|'.join(key), str(to_decimal(cost))])
+
+
+def write_jsonl(records, fp):
+    dimensions = {}
+    for window, start, end, metric_name, key, cost in records:
+        if metric_name not in dimensions:
+            dimensions[metric_name] = _dimensions(metric_name).split('|')
+        record = {'start': start.isoformat(),
+                  'end': end.isoformat(),
+                  'metric': metric_name,
+                  'cost': str(to_decimal(cost))}
+        if window:
+            record['window'] = window
+        record.update(zip(dimensions[metric_name], key))
+        fp.write(json.dumps(record, sort_keys=True))
+        fp.write('\n')
+
+
+def _epoch(timestamp):
+    return calendar.timegm(timestamp.utctimetuple())
+
+
+def _column(typecode, values):
+    return struct.pack('<%d%s' % (len(values), typecode), *values)
+
+
+def _write_block(fp, block, new_strings):
+    fp.write(struct.pack('<II', len(block), len(new_strings)))
+    for value in new_strings:
+        data = value.encode('utf-8')
+        fp.write(struct.pack('<I', len(data)))
+        fp.write(data)
+    for i, typecode in enumerate(_ColumnTypes):
+        fp.write(_column(typecode, [record[i] for record in block]))
+
+
+def write_columnar(records, fp, block_size=BlockSize):
+    # The (binary) fp gets the records in the columnar format
+    fp.write(ColumnarMagic)
+    fp.write(struct.pack('<I', ColumnarVersion))
+    strings = {}
+    new_strings = []
+
+    def string_id(value):
+        if value not in strings:
+            strings[value] = len(strings)
+            new_strings.append(value)
+        return strings[value]
+
+    block = []
+    for window, start, end, metric_name, key, cost in records:
+        block.append((_epoch(start), _epoch(end), string_id(window),
+                      string_id(metric_name), string_id('|'.join(key)),
+                      cost))
+        if len(block) >= block_size:
+            _write_block(fp, block, new_strings)
+            block = []
+            new_strings = []
+    if block:
+        _write_block(fp, block, new_strings)
+        new_strings = []
+    _write_block(fp, [], [])
+
+
+def _read(fp, size):
+    data = fp.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated columnar export')
+    return data
+
+
+def _read_column(fp, typecode, count):
+    size = struct.calcsize('<%d%s' % (count, typecode))
+    return struct.unpack('<%d%s' % (count, typecode), _read(fp, size))
+
+
+def read_columnar(fp):
+    # Yields the records of a columnar export written by write_columnar
+    if _read(fp, len(ColumnarMagic)) != ColumnarMagic:
+        raise ValueError('Not a columnar export')
+    version, = struct.unpack('<I', _read(fp, 4))
+    if version != ColumnarVersion:
+        raise ValueError('Unknown columnar export version (%s)' % version)
+    strings = []
+    keys = {}
+    while True:
+        count, nstrings = struct.unpack('<II', _read(fp, 8))
+        for _ in range(0, nstrings):
+            size, = struct.unpack('<I', _read(fp, 4))
+            strings.append(_read(fp, size).decode('utf-8'))
+        if count == 0:
+            return
+        columns = [_read_column(fp, typecode, count)
+                   for typecode in _ColumnTypes]
+        for start, end, window, metric, key, cost in zip(*columns):
+            if key not in keys:
+                keys[key] = tuple(strings[key].split('|'))
+            yield (strings[window],
+                   datetime.datetime.fromtimestamp(start, _UTC),
+                   datetime.datetime.fromtimestamp(end, _UTC),
+                   strings[metric], keys[key], cost)
+
+
+Writers = {'csv': write_csv,
+           'jsonl': write_jsonl,
+           'columnar': write_columnar}
+
+
+def export(superslice, path, fmt='csv', granularity='hour', windows=None):
+    if fmt not in Writers:
+        raise ValueError('Unknown export format (%s)' % fmt)
+    if fmt == 'columnar':
+        fp = open(path, 'wb')
+    elif sys.version_info[0] >= 3:
+        fp = open(path, 'w', newline='')
+    else:
+        fp = open(path, 'wb')
+    try:
+        Writers[fmt](records(superslice, granularity, windows), fp)
+    finally:
+        fp.close()
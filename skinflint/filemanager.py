@@ -12,18 +12,28 @@
 # language governing permissions and limitations under the License.
 
 import os
-import datetime
 import zipfile
 import logging
+import threading
+from multiprocessing.pool import ThreadPool
 
-import pytz
-import dateutil.tz
 import boto
+import boto.s3.connection
 
 from skinflint.billreader import *
+from skinflint import snapshot
+from skinflint import stats
+from skinflint.manifest import Manifest
+from skinflint.slice import SuperSlice
+from skinflint.columnar import ColumnarSuperSlice
 
 LOG = logging.getLogger(__name__)
 
+# The SuperSlice class that parses detailed billing reports, by the
+# value of the engine config option.  The columnar engine needs numpy.
+Engines = {'python': SuperSlice,
+           'columnar': ColumnarSuperSlice}
+
 
 class FileManager(object):
 
@@ -34,62 +44,197 @@ class FileManager(object):
         self.cache_dir = os.path.expandvars(self.cache_dir)
         if not os.path.isdir(self.cache_dir):
             os.mkdir(self.cache_dir)
+        self.compressed_cache = self.config.get('compressed_cache', False)
+        self.parse_workers = self.config.get('parse_workers', 1)
+        self.engine = self.config.get('engine', 'python')
+        if self.engine not in Engines:
+            raise ValueError('Unknown engine (%s)' % self.engine)
+        self.download_workers = self.config.get('download_workers', 4)
+        self.multipart_threshold = self.config.get(
+            'multipart_threshold', 256 * 1024 * 1024)
+        self.multipart_chunk_size = self.config.get(
+            'multipart_chunk_size', 64 * 1024 * 1024)
+        # S3 connections by profile and bucket handles by (profile,
+        # bucket name), shared by the threads of fetch_many.
+        self._connections = {}
+        self._buckets = {}
+        self._listings = {}
+        self._lock = threading.Lock()
+        self.manifest = Manifest(self.cache_dir)
+
+    def _connect(self, profile):
+        # The s3 config can point at a local S3 stand-in, e.g.
+        #     s3:
+        #         host: localhost
+        #         port: 4567
+        #         is_secure: false
+        s3_config = self.config.get('s3') or {}
+        kwargs = {}
+        if 'host' in s3_config:
+            kwargs['host'] = s3_config['host']
+            kwargs['calling_format'] = (
+                boto.s3.connection.OrdinaryCallingFormat())
+        for name in ('port', 'is_secure'):
+            if name in s3_config:
+                kwargs[name] = s3_config[name]
+        return boto.connect_s3(profile_name=profile, **kwargs)
 
-    def _get_file_modified_time(self, file_path):
-        stats = os.stat(file_path)
-        return datetime.datetime.fromtimestamp(
-            stats.st_atime, dateutil.tz.tzlocal())
+    def _get_connection(self, profile):
+        with self._lock:
+            s3 = self._connections.get(profile)
+            if s3 is None:
+                s3 = self._connect(profile)
+                self._connections[profile] = s3
+            return s3
 
-    def _get_key_modified_time(self, key):
-        ts = boto.utils.parse_ts(key.last_modified)
-        return pytz.utc.localize(ts)
+    def _get_bucket(self, account_id):
+        account_cfg = self.config['accounts'][account_id]
+        profile = account_cfg['profile']
+        bucket_key = (profile, account_cfg['bucket'])
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            s3 = self._get_connection(profile)
+            bucket = s3.lookup(account_cfg['bucket'])
+            if bucket is None:
+                raise ValueError(
+                    'Bucket (%s) does not exist' % account_cfg['bucket'])
+            with self._lock:
+                bucket = self._buckets.setdefault(bucket_key, bucket)
+        return bucket
 
     def _download_and_unzip(self, key):
         LOG.debug('downloading %s', key.name)
         key_path = os.path.join(self.cache_dir, key.name)
-        key.get_contents_to_filename(key_path)
-        if key.name.endswith('.zip'):
-            zf = zipfile.ZipFile(key_path)
-            namelist = zf.namelist()
-            dbf = namelist[0]
-            LOG.debug('unzipping downloaded file')
-            zf.extract(dbf, self.cache_dir)
-            zf.close()
+        with stats.timer('filemanager.download'):
+            if key.size is not None and key.size > self.multipart_threshold:
+                self._download_ranges(key, key_path)
+            else:
+                key.get_contents_to_filename(key_path)
+        stats.incr('filemanager.downloads')
+        if stats.enabled():
+            stats.incr('filemanager.download_bytes',
+                       os.path.getsize(key_path))
+        if key.name.endswith('.zip') and not self.compressed_cache:
+            with stats.timer('filemanager.unzip'):
+                zf = zipfile.ZipFile(key_path)
+                namelist = zf.namelist()
+                dbf = namelist[0]
+                LOG.debug('unzipping downloaded file')
+                zf.extract(dbf, self.cache_dir)
+                zf.close()
             LOG.debug('deleting zip file')
             os.unlink(key_path)
 
+    def _download_range(self, args):
+        key, path, start, end = args
+        range_key = key.bucket.new_key(key.name)
+        fp = open(path, 'r+b')
+        try:
+            fp.seek(start)
+            range_key.get_contents_to_file(
+                fp, headers={'Range': 'bytes=%d-%d' % (start, end - 1)})
+        finally:
+            fp.close()
+
+    def _download_ranges(self, key, key_path):
+        # Large keys are fetched as several ranged GETs at once, each
+        # writing its part of a file of the final size.
+        LOG.debug('downloading %s in ranges', key.name)
+        part_path = key_path + '.part'
+        fp = open(part_path, 'wb')
+        try:
+            fp.truncate(key.size)
+        finally:
+            fp.close()
+        chunk_size = self.multipart_chunk_size
+        ranges = [(key, part_path, start, min(start + chunk_size, key.size))
+                  for start in range(0, key.size, chunk_size)]
+        pool = ThreadPool(max(1, min(self.download_workers, len(ranges))))
+        try:
+            pool.map(self._download_range, ranges)
+        finally:
+            pool.close()
+            pool.join()
+        os.rename(part_path, key_path)
+
     def _check_key(self, key, file_name):
-        if not os.path.isfile(file_name):
-            LOG.debug('%s not in cache, downloading now', file_name)
-            self._download_and_unzip(key)
-            file_mod_time = self._get_file_modified_time(file_name)
-        else:
-            file_mod_time = self._get_file_modified_time(file_name)
-            LOG.debug('file_mod_time: %s', file_mod_time)
-            key_mod_time = self._get_key_modified_time(key)
-            LOG.debug('key_mod_time: %s', key_mod_time)
-            if key_mod_time > file_mod_time:
-                LOG.debug('cached copy of %s out of date', file_name)
-                self._download_and_unzip(key)
+        if self.manifest.is_fresh(key, file_name):
+            stats.incr('filemanager.cache_hits')
+            return
+        LOG.debug('%s not in cache or out of date, downloading now',
+                  file_name)
+        self._download_and_unzip(key)
+        self.manifest.update(key, file_name)
 
-    def _get_bill_reader(self, billreader_cls, account_id, year, month):
-        account_cfg = self.config['accounts'][account_id]
-        s3 = boto.connect_s3(profile_name=account_cfg['profile'])
-        bucket = s3.lookup(account_cfg['bucket'])
+    def _list_bucket(self, bucket, prefix):
+        # A single listing of the reports of an account gives the ETag
+        # and size of every month of them, rather than a HEAD request
+        # per report.
+        listing_key = (bucket.name, prefix)
+        with self._lock:
+            keys = self._listings.get(listing_key)
+        if keys is None:
+            keys = dict((key.name, key)
+                        for key in bucket.list(prefix=prefix))
+            with self._lock:
+                keys = self._listings.setdefault(listing_key, keys)
+        return keys
+
+    def _get_bill_file(self, billreader_cls, account_id, year, month):
+        bucket = self._get_bucket(account_id)
         key_name = billreader_cls.KeyName.format(
             id=account_id, year=year, month=month)
-        key = bucket.lookup(key_name)
+        # The part of the key name before the date
+        prefix = billreader_cls.KeyName.split('{year}')[0].format(
+            id=account_id)
+        key = self._list_bucket(bucket, prefix).get(key_name)
         if key is None:
             msg = 'Bucket (%s) does not contain Key (%s)' % (bucket, key_name)
             raise ValueError(msg)
-        if key_name.endswith('.zip'):
+        if key_name.endswith('.zip') and not self.compressed_cache:
             file_name = key_name[0:-4]
         else:
             file_name = key_name
         file_name = os.path.join(self.cache_dir, file_name)
         self._check_key(key, file_name)
+        return file_name, key
+
+    def fetch_many(self, requests):
+        # Makes sure the reports of several (billreader_cls, account_id,
+        # year, month) requests are in the cache, downloading up to
+        # download_workers of them at once, and returns their file names
+        # in the order of the requests.
+        def fetch(request):
+            return self._get_bill_file(*request)[0]
+        requests = list(requests)
+        if self.download_workers <= 1 or len(requests) <= 1:
+            return [fetch(request) for request in requests]
+        pool = ThreadPool(min(self.download_workers, len(requests)))
+        try:
+            return pool.map(fetch, requests)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _get_bill_reader(self, billreader_cls, account_id, year, month):
+        file_name, _ = self._get_bill_file(
+            billreader_cls, account_id, year, month)
         return billreader_cls(file_name)
 
+    def get_detailed_billing_superslice(self, account_id, year, month,
+                                        now=None):
+        # Parsing a detailed billing report is slow, so the result is
+        # kept in a snapshot next to the cached report and reused for as
+        # long as the report does not change.  When only new rows have
+        # been appended to the report just those are parsed.
+        file_name, key = self._get_bill_file(
+            DetailedBillReportReader, account_id, year, month)
+        source_fingerprint = snapshot.fingerprint(file_name, key.etag)
+        return snapshot.refresh(
+            file_name, source_fingerprint, now, self.parse_workers,
+            Engines[self.engine])
+
     def get_detailed_billing_report_reader(self, account_id, year, month):
         return self._get_bill_reader(
             DetailedBillReportReader, account_id, year, month)
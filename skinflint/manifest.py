@@ -0,0 +1,97 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import json
+import logging
+import tempfile
+import threading
+
+LOG = logging.getLogger(__name__)
+
+# The manifest records, for every S3 key in the cache, the ETag, size
+# and last modified time the key had when it was downloaded and the
+# file it was saved as.  A cached file is fresh while the key still has
+# that ETag and size and the file still has the size it was saved with.
+# Several processes can share a cache, so every update merges in what
+# the others have saved since and is written to a temporary file of its
+# own before replacing the manifest.
+ManifestName = 'manifest.json'
+ManifestVersion = 1
+
+
+class Manifest(object):
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, ManifestName)
+        self._lock = threading.Lock()
+        self._entries = self._read()
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return {}
+        fp = open(self.path)
+        try:
+            try:
+                data = json.load(fp)
+            except ValueError:
+                LOG.debug('unreadable manifest %s', self.path)
+                return {}
+        finally:
+            fp.close()
+        if data.get('version') != ManifestVersion:
+            return {}
+        return data.get('keys', {})
+
+    def _save(self, key_name, entry):
+        entries = self._read()
+        entries[key_name] = entry
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=ManifestName + '.', suffix='.tmp',
+            dir=os.path.dirname(self.path))
+        try:
+            fp = os.fdopen(fd, 'w')
+            try:
+                json.dump({'version': ManifestVersion, 'keys': entries},
+                          fp, indent=2, sort_keys=True)
+            finally:
+                fp.close()
+            os.rename(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._entries = entries
+
+    def get(self, key_name):
+        with self._lock:
+            return self._entries.get(key_name)
+
+    def is_fresh(self, key, file_name):
+        entry = self.get(key.name)
+        if entry is None:
+            return False
+        if entry['etag'] != key.etag or entry['size'] != key.size:
+            return False
+        if entry['file'] != file_name or not os.path.isfile(file_name):
+            return False
+        return os.path.getsize(file_name) == entry['file_size']
+
+    def update(self, key, file_name):
+        with self._lock:
+            self._save(key.name, {
+                'etag': key.etag,
+                'size': key.size,
+                'last_modified': key.last_modified,
+                'file': file_name,
+                'file_size': os.path.getsize(file_name)})
@@ -13,6 +13,7 @@
 
 import decimal
 import datetime
+import numbers
 import re
 
 Epoch = datetime.datetime(1970, 1, 1)
@@ -42,6 +43,37 @@ ServiceMap = {
 }
 
 
+# Costs are accumulated as integer multiples of 10 ** -FixedPointDigits
+# dollars, which is exact for the 8 decimal places used in billing
+# reports, and only turned back into Decimal when they are read.
+FixedPointDigits = 8
+FixedPointScale = 10 ** FixedPointDigits
+
+
+def to_fixed(value):
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if not isinstance(value, decimal.Decimal):
+        whole, _, fraction = value.partition('.')
+        # Values without any digits, like '' or '-', are left to Decimal
+        # to reject.
+        if (len(fraction) <= FixedPointDigits and
+                (whole.lstrip('+-') or fraction)):
+            try:
+                return int(whole + fraction +
+                           '0' * (FixedPointDigits - len(fraction)))
+            except ValueError:
+                pass
+        value = decimal.Decimal(value)
+    # Anything finer than the fixed point precision is rounded.
+    value = value.scaleb(FixedPointDigits)
+    return int(value.to_integral_value(decimal.ROUND_HALF_EVEN))
+
+
+def to_decimal(value):
+    return decimal.Decimal(value).scaleb(-FixedPointDigits)
+
+
 def total_seconds(delta):
     # python2.6 does not have timedelta.total_seconds() so we have
     # to calculate this ourselves.  This is straight from the
@@ -50,62 +82,240 @@ def total_seconds(delta):
              * 10 ** 6) / 10 ** 6)
 
 
+# Dimension keys are tuples of dimension values.  Metrics that are
+# given a dict of keys when a key is added share the key stored in it,
+# so every distinct key of a load is stored once for all of its slices.
+# The dict belongs to the load rather than to this module, so keys are
+# not kept beyond the metrics that use them.
+
+# Query values containing any of these are treated as regular expressions
+PatternChars = frozenset('.^$*+?{}[]\\|()')
+
+
+def is_pattern(value):
+    return not PatternChars.isdisjoint(value)
+
+
+class _ReadOnlyDict(dict):
+
+    # What Metric.data returns.  Changing it would not change the
+    # metric, so it cannot be changed.
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Metric data is read only')
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+
+# Most metrics of an hourly slice never get a key, so they all share
+# this empty dict until their first key is added.  It must never be
+# written to.
+_NoData = {}
+
+
 class Metric(object):
 
+    __slots__ = ('_data', '_index', '_decimal')
+
     Dimensions = ''
+    Columns = ('BlendedCost',)
 
     def __init__(self):
-        self.data = {}
+        self._data = _NoData
+        # Per dimension maps of value -> set of keys, built by the first
+        # query and kept up to date as new keys are added.
+        self._index = None
+        # The result of data, until the next cost is added
+        self._decimal = None
 
     def __repr__(self):
         return self.__class__.__name__
 
+    def __getstate__(self):
+        # The index is not pickled, it is rebuilt when next needed.  The
+        # state is a tuple so that it is never false, otherwise pickle
+        # would not call __setstate__.
+        if self._data is _NoData:
+            return (None,)
+        return (self._data,)
+
+    def __setstate__(self, state):
+        # Keys shared by the pickled metrics are shared again once they
+        # are unpickled.
+        data, = state
+        self._data = _NoData
+        if data:
+            self._data = data
+        self._index = None
+        self._decimal = None
+
+    @property
+    def data(self):
+        # A read only dict of the '|' separated keys and their Decimal
+        # costs.  It is built once and then reused until the next cost
+        # is added.
+        if self._decimal is None:
+            self._decimal = _ReadOnlyDict(self.to_decimal_dict())
+        return self._decimal
+
+    def to_decimal_dict(self):
+        return {'|'.join(k): to_decimal(v) for k, v in self._data.items()}
+
+    def items(self):
+        # (key, cost) pairs, with the key a tuple of dimension values and
+        # the cost in fixed point
+        return self._data.items()
+
     def __add__(self, other):
-        all_subdims = set(self.data.keys())
-        all_subdims.update(other.data.keys())
-        for subdim in all_subdims:
-            if subdim not in self.data:
-                self.data[subdim] = decimal.Decimal('0.0')
-            other_value = other.data.get(subdim, decimal.Decimal('0.0'))
-            self.data[subdim] += other_value
+        # Only the keys of other need visiting, which keeps adding a
+        # small slice into a large aggregate cheap.
+        if not other._data:
+            return
+        if self._data is _NoData:
+            self._data = {}
+        self._decimal = None
+        data = self._data
+        for subdim, other_value in other._data.items():
+            if subdim not in data:
+                data[subdim] = other_value
+                if self._index is not None:
+                    self._index_key(subdim)
+            else:
+                data[subdim] += other_value
 
     def keyfn(self, data):
         pass
 
-    def add(self, data):
+    def add(self, data, keys=None):
+        # Costs may be Decimals, strings or ints that are already in
+        # fixed point, as produced by a fixed_point ReportReader.  New
+        # keys are shared through keys, see above.
         dimension_key = self.keyfn(data)
         if dimension_key is not None:
-            if dimension_key not in self.data:
-                self.data[dimension_key] = decimal.Decimal('0.0')
-            self.data[dimension_key] += data['BlendedCost']
+            cost = data['BlendedCost']
+            if not isinstance(cost, int):
+                cost = to_fixed(cost)
+            self._decimal = None
+            if dimension_key in self._data:
+                self._data[dimension_key] += cost
+            else:
+                if self._data is _NoData:
+                    self._data = {}
+                if keys is not None:
+                    dimension_key = keys.setdefault(dimension_key,
+                                                    dimension_key)
+                self._data[dimension_key] = cost
+                if self._index is not None:
+                    self._index_key(dimension_key)
+
+    def add_cost(self, dimension_key, cost, keys=None):
+        # cost is in fixed point
+        self._decimal = None
+        if dimension_key in self._data:
+            self._data[dimension_key] += cost
+        else:
+            if self._data is _NoData:
+                self._data = {}
+            if keys is not None:
+                dimension_key = keys.setdefault(dimension_key, dimension_key)
+            self._data[dimension_key] = cost
+            if self._index is not None:
+                self._index_key(dimension_key)
+
+    def _index_key(self, key):
+        for i in range(0, len(key)):
+            values = self._index[i]
+            if key[i] not in values:
+                values[key[i]] = set()
+            values[key[i]].add(key)
+
+    def _build_index(self):
+        self._index = [{} for _ in self.Dimensions.split('|')]
+        for key in self._data:
+            self._index_key(key)
+
+    def _lookup(self, dimensions, kwargs):
+        if self._index is None:
+            self._build_index()
+        keys = None
+        for i in range(0, len(dimensions)):
+            if dimensions[i] in kwargs:
+                matches = self._index[i].get(kwargs[dimensions[i]], set())
+                if keys is None:
+                    keys = set(matches)
+                else:
+                    keys &= matches
+        if keys is None:
+            keys = self._data.keys()
+        return keys
 
     def query(self, **kwargs):
+        # Exact values are looked up in the index, anything that looks
+        # like a pattern falls back to matching a regex against the
+        # '|' separated form of every key.
         dimensions = self.Dimensions.split('|')
+        patterns = [v for k, v in kwargs.items()
+                    if k in dimensions and is_pattern(v)]
+        if not patterns:
+            keys = self._lookup(dimensions, kwargs)
+            return {'|'.join(k): to_decimal(self._data[k]) for k in keys}
         regexs = []
         for dimension in dimensions:
             if dimension in kwargs:
                 regexs.append(kwargs[dimension])
             else:
                 regexs.append('.*')
-        regex = '\|'.join(regexs)
+        regex = r'\|'.join(regexs)
         regex = re.compile(regex)
-        filtered_keys = [k for k in self.data.keys() if regex.match(k)]
-        return {k: self.data[k] for k in filtered_keys}
+        result = {}
+        for k, v in self._data.items():
+            k = '|'.join(k)
+            if regex.match(k):
+                result[k] = to_decimal(v)
+        return result
+
+    def group_by(self, *dimensions):
+        # Totals for every combination of the named dimensions, keyed by
+        # the value itself when a single dimension is given and by a
+        # tuple of values otherwise.
+        dimension_names = self.Dimensions.split('|')
+        positions = []
+        for dimension in dimensions:
+            if dimension not in dimension_names:
+                raise ValueError('%s has no dimension (%s)' % (
+                    self, dimension))
+            positions.append(dimension_names.index(dimension))
+        totals = {}
+        for k, v in self._data.items():
+            if len(positions) == 1:
+                group = k[positions[0]]
+            else:
+                group = tuple([k[i] for i in positions])
+            if group in totals:
+                totals[group] += v
+            else:
+                totals[group] = v
+        return {k: to_decimal(v) for k, v in totals.items()}
 
     def dimensions(self):
         dimension_names = self.Dimensions.split('|')
         dimensions = {k: [] for k in dimension_names}
-        for k in self.data:
-            dimension_values = k.split('|')
-            for i in range(0, len(dimension_values)):
-                if dimension_values[i] not in dimensions[dimension_names[i]]:
-                    dimensions[dimension_names[i]].append(dimension_values[i])
+        seen = [set() for k in dimension_names]
+        for k in self._data:
+            for i in range(0, len(k)):
+                if k[i] not in seen[i]:
+                    seen[i].add(k[i])
+                    dimensions[dimension_names[i]].append(k[i])
         return dimensions
 
 
 class TotalUsage(Metric):
 
+    __slots__ = ()
+
     Dimensions = 'account|service|type'
+    Columns = ('LinkedAccountId', 'ProductName', 'UsageType', 'BlendedCost')
 
     def keyfn(self, data):
         if not data['UsageType']:
@@ -114,13 +324,16 @@ class TotalUsage(Metric):
             charge_type = 'usage'
         product_name = data['ProductName']
         product_name = ServiceMap.get(product_name, product_name)
-        key = '%s|%s|%s' % (data['LinkedAccountId'], product_name, charge_type)
+        key = (data['LinkedAccountId'], product_name, charge_type)
         return key
 
 
 class InstanceCost(Metric):
 
+    __slots__ = ()
+
     Dimensions = 'account|service|instance_type'
+    Columns = ('LinkedAccountId', 'ProductName', 'UsageType', 'BlendedCost')
 
     def keyfn(self, data):
         key = None
@@ -131,7 +344,7 @@ class InstanceCost(Metric):
                 _, instance_type = usage_type.split(':')
             else:
                 instance_type = 'm1.small'
-            key = '%s|%s|%s' % (
+            key = (
                 data['LinkedAccountId'],
                 ServiceMap.get(product_name, product_name),
                 instance_type)
@@ -140,14 +353,17 @@ class InstanceCost(Metric):
 
 class DataTransfer(Metric):
 
+    __slots__ = ()
+
     Dimensions = 'account|service|transfer_type'
+    Columns = ('LinkedAccountId', 'ProductName', 'UsageType', 'BlendedCost')
 
     def keyfn(self, data):
         key = None
         if data['UsageType'].startswith('DataTransfer'):
             product_name = data['ProductName']
             _, transfer_type, _ = data['UsageType'].split('-')
-            key = '%s|%s|%s' % (
+            key = (
                 data['LinkedAccountId'],
                 ServiceMap.get(product_name, product_name),
                 transfer_type)
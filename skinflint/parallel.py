@@ -0,0 +1,181 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import csv
+import sys
+import mmap
+import logging
+import multiprocessing
+
+from skinflint import stats
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.slice import SuperSlice
+
+LOG = logging.getLogger(__name__)
+
+# Quote counts are done on pieces of the memory map of at most this size
+ChunkSize = 64 * 1024 * 1024
+
+
+def _parse_line(line):
+    if sys.version_info[0] >= 3:
+        line = line.decode('utf-8')
+    for fields in csv.reader([line]):
+        return fields
+    return []
+
+
+def _count_quotes(mm, start, end):
+    count = 0
+    while start < end:
+        chunk_end = min(end, start + ChunkSize)
+        count += mm[start:chunk_end].count(b'"')
+        start = chunk_end
+    return count
+
+
+def _read_line(mm, pos):
+    end = mm.find(b'\n', pos)
+    if end == -1:
+        end = len(mm)
+    else:
+        end += 1
+    return mm[pos:end], end
+
+
+def _header(mm):
+    # The header fields and the offset of the first row after them,
+    # skipping any lines before the header like ReportReader does.
+    pos = 0
+    while pos < len(mm):
+        line, pos = _read_line(mm, pos)
+        fields = _parse_line(line)
+        if len(fields) > 1:
+            return fields, pos
+    return [], pos
+
+
+def _rate_id(mm, pos, rate_index):
+    while pos < len(mm):
+        line, pos = _read_line(mm, pos)
+        if line.strip():
+            fields = _parse_line(line)
+            if rate_index < len(fields):
+                return fields[rate_index]
+            return None
+    return None
+
+
+def split_report(filepath, parts):
+    # Splits the rows of an uncompressed report into at most parts byte
+    # ranges of about the same size.  Each range starts at the start of
+    # a row: a newline only ends a row when it is outside of a quoted
+    # field, which is the case when an even number of quotes precede
+    # it.  A range never starts with a row whose RateId is 0, since
+    # SuperSlice.load adds those rows to the slice of the row before.
+    fp = open(filepath, 'rb')
+    try:
+        size = os.fstat(fp.fileno()).st_size
+        if size == 0:
+            return []
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        fp.close()
+    try:
+        headers, start = _header(mm)
+        rate_index = None
+        if 'RateId' in headers:
+            rate_index = headers.index('RateId')
+        boundaries = [start]
+        pos = start
+        quotes = 0
+        for i in range(1, parts):
+            target = start + (size - start) * i // parts
+            if target <= pos:
+                continue
+            quotes += _count_quotes(mm, pos, target)
+            pos = target
+            while pos < size:
+                newline = mm.find(b'\n', pos)
+                if newline == -1:
+                    pos = size
+                    break
+                quotes += _count_quotes(mm, pos, newline)
+                pos = newline + 1
+                if quotes % 2 == 0 and (
+                        rate_index is None or
+                        _rate_id(mm, pos, rate_index) != '0'):
+                    break
+            if pos >= size:
+                break
+            boundaries.append(pos)
+        boundaries.append(size)
+    finally:
+        mm.close()
+    return [(boundaries[i], boundaries[i + 1])
+            for i in range(0, len(boundaries) - 1)
+            if boundaries[i] < boundaries[i + 1]]
+
+
+def _load_range(args):
+    filepath, start, end, now, superslice_cls = args
+    ss = superslice_cls(now)
+    dbr = DetailedBillReportReader(filepath, offset=start, end=end)
+    try:
+        ss.load(dbr)
+    finally:
+        dbr.close()
+    return ss
+
+
+def _collect_range(args):
+    # Loads a range in a worker of a pool, returning its stats with it
+    job, enabled = args
+    return stats.collect(_load_range, (job,), enabled)
+
+
+def load_report(filepath, workers, now=None, superslice_cls=SuperSlice):
+    # Loads a detailed billing report into a SuperSlice, parsing byte
+    # ranges of the report in up to workers processes.  The partial
+    # SuperSlices are merged by slice key so the order in which the
+    # ranges finish does not matter.  Zipped reports can not be split
+    # and are loaded in this process.  The ranges are loaded with
+    # superslice_cls, which has to be importable by the workers.
+    ss = superslice_cls(now)
+    if workers <= 1 or filepath.endswith('.zip'):
+        dbr = DetailedBillReportReader(filepath)
+        try:
+            ss.load(dbr)
+        finally:
+            dbr.close()
+        return ss
+    ranges = split_report(filepath, workers)
+    LOG.debug('parsing %s in %d ranges', filepath, len(ranges))
+    jobs = [(filepath, start, end, now, superslice_cls)
+            for start, end in ranges]
+    if len(jobs) <= 1:
+        for job in jobs:
+            ss.merge(_load_range(job))
+        return ss
+    pool = multiprocessing.Pool(min(workers, len(jobs)))
+    enabled = stats.enabled()
+    try:
+        for partial, collected in pool.imap_unordered(
+                _collect_range, [(job, enabled) for job in jobs]):
+            ss.merge(partial)
+            stats.merge(collected)
+    finally:
+        pool.close()
+        pool.join()
+    return ss
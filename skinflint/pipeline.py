@@ -0,0 +1,181 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import collections
+import logging
+import multiprocessing
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from skinflint import snapshot
+from skinflint import stats
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.filemanager import Engines
+from skinflint.slice import SuperSlice
+
+LOG = logging.getLogger(__name__)
+
+# Loads many detailed billing reports, parsing the reports that have
+# been downloaded while the rest are still downloading.  Download
+# threads put the reports they fetched on a bounded queue, which holds
+# back the downloads when parsing falls behind.  Each report is parsed
+# in a process of a pool (or in this process if there is a single
+# worker) and at most workers reports are being parsed at any time.
+# Reports finish downloading in any order, so a parsed report is held
+# until the reports requested before it have been merged, which keeps
+# the result the same from run to run.  A download only starts when a
+# token is free, and the token is given back once its report has been
+# merged, so a slow report holds back the downloads after it rather
+# than letting the parsed reports pile up.  Parsing only starts once a
+# report is fully downloaded: the central directory of a zip file is at
+# its end and the snapshot of a report is keyed on a digest of all of
+# it.
+
+_Done = object()
+
+
+def _download(fm, requests, ready, tokens, stop):
+    while True:
+        tokens.acquire()
+        if stop.is_set():
+            break
+        try:
+            index, (account_id, year, month) = requests.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            file_name, key = fm._get_bill_file(
+                DetailedBillReportReader, account_id, year, month)
+            ready.put(((index, file_name,
+                        snapshot.fingerprint(file_name, key.etag)), None))
+        except Exception as e:
+            LOG.exception('downloading %s %s-%s', account_id, year, month)
+            ready.put((None, e))
+    ready.put((_Done, None))
+
+
+def _drain(ready):
+    while True:
+        try:
+            ready.get_nowait()
+        except queue.Empty:
+            return
+
+
+def _parse(args):
+    file_name, source_fingerprint, now, engine = args
+    return snapshot.refresh(
+        file_name, source_fingerprint, now, 1, Engines[engine])
+
+
+def _collect_parse(args):
+    # Parses a report in a worker of a pool, returning its stats with it
+    job, enabled = args
+    return stats.collect(_parse, (job,), enabled)
+
+
+def load_reports(fm, requests, now, workers=1, queue_size=None):
+    # requests are (account_id, year, month) tuples.  Returns a single
+    # SuperSlice with all of the reports merged in request order.
+    ss = SuperSlice(now)
+    requests = list(requests)
+    if not requests:
+        return ss
+    if queue_size is None:
+        queue_size = max(1, workers)
+    pending = queue.Queue()
+    for index, request in enumerate(requests):
+        pending.put((index, request))
+    ready = queue.Queue(queue_size)
+    pool = None
+    if workers > 1:
+        # The pool is started before the download threads so that no
+        # thread is running when the worker processes fork.
+        pool = multiprocessing.Pool(min(workers, len(requests)))
+    nthreads = max(1, min(fm.download_workers, len(requests)))
+    # Enough tokens for every download thread, the queue and the
+    # workers while the reports arrive in order.
+    tokens = threading.Semaphore(nthreads + queue_size + workers)
+    stop = threading.Event()
+    threads = []
+    for _ in range(0, nthreads):
+        thread = threading.Thread(
+            target=_download, args=(fm, pending, ready, tokens, stop))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    in_flight = collections.deque()
+    parsed = {}
+    merged = [0]
+
+    def get_parsed(result):
+        parsed_ss, collected = result.get()
+        stats.merge(collected)
+        return parsed_ss
+
+    def merge_parsed():
+        # Merges the parsed reports that are next in request order
+        while merged[0] in parsed:
+            ss.merge(parsed.pop(merged[0]))
+            merged[0] += 1
+            tokens.release()
+
+    done = 0
+    try:
+        while done < len(threads):
+            with stats.timer('pipeline.wait_download'):
+                item, error = ready.get()
+            if error is not None:
+                raise error
+            if item is _Done:
+                done += 1
+                continue
+            index, job = item[0], item[1:] + (now, fm.engine)
+            if pool is None:
+                parsed[index] = _parse(job)
+                merge_parsed()
+                continue
+            in_flight.append((index, pool.apply_async(
+                _collect_parse, ((job, stats.enabled()),))))
+            while len(in_flight) > workers:
+                index, result = in_flight.popleft()
+                parsed[index] = get_parsed(result)
+                merge_parsed()
+        with stats.timer('pipeline.wait_parse'):
+            while in_flight:
+                index, result = in_flight.popleft()
+                parsed[index] = get_parsed(result)
+                merge_parsed()
+    except Exception:
+        if pool is not None:
+            pool.terminate()
+            pool = None
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        # After an error the download threads are stopped, waking those
+        # waiting for a token or for room on the queue.
+        stop.set()
+        for _ in threads:
+            tokens.release()
+        for thread in threads:
+            while thread.is_alive():
+                _drain(ready)
+                thread.join(0.1)
+    return ss
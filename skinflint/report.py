@@ -4,10 +4,15 @@ from xlsxwriter.utility import xl_rowcol_to_cell
 
 class Page(object):
 
-    def __init__(self, name, report, worksheet):
+    def __init__(self, name, report, worksheet, buffered=False):
         self.name = name
         self._report = report
         self._worksheet = worksheet
+        self._buffered = buffered
+        self._finished = False
+        self._rows = None
+        if buffered:
+            self._rows = {}
 
     @property
     def worksheet(self):
@@ -17,8 +22,53 @@ class Page(object):
     def report(self):
         return self._report
 
+    @property
+    def buffered(self):
+        return self._buffered
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def _check_open(self):
+        # Once a buffered page is flushed nothing flushes it again, so a
+        # later write would be lost.
+        if self._buffered and self._finished:
+            raise ValueError('Page %s is already written out' % self.name)
+
     def write(self, row, col, value, fmt=None):
-        self.worksheet.write(row, col, value, fmt)
+        self._check_open()
+        if self._rows is None:
+            self.worksheet.write(row, col, value, fmt)
+        else:
+            self._buffer(row, ('write', row, col, value, fmt))
+
+    def merge_range(self, first_row, first_col, last_row, last_col, data,
+                    fmt=None):
+        self._check_open()
+        if self._rows is None:
+            self.worksheet.merge_range(
+                first_row, first_col, last_row, last_col, data, fmt)
+        else:
+            self._buffer(first_row, ('merge_range', first_row, first_col,
+                                     last_row, last_col, data, fmt))
+
+    def _buffer(self, row, call):
+        if row not in self._rows:
+            self._rows[row] = []
+        self._rows[row].append(call)
+
+    def flush(self):
+        # In constant memory mode xlsxwriter only takes rows in order,
+        # so the writes to a page are kept until the page is done and
+        # then made row by row.
+        self._finished = True
+        if not self._rows:
+            return
+        for row in sorted(self._rows):
+            for call in self._rows[row]:
+                getattr(self.worksheet, call[0])(*call[1:])
+        self._rows = {}
 
     def cell_ref(self, row, col, abs_row=False, abs_col=False, fqn=False):
         cell_ref = xl_rowcol_to_cell(row, col, abs_row, abs_col)
@@ -39,7 +89,7 @@ class Page(object):
                 fmt = None
             merge_range = header.get('range', None)
             if merge_range:
-                self.worksheet.merge_range(
+                self.merge_range(
                     row + merge_range[0][0], col + merge_range[0][1],
                     row + merge_range[1][0], col + merge_range[1][1],
                     header.get('label', ''),
@@ -54,7 +104,7 @@ class Page(object):
                             col, col, width, None, {'hidden': hidden})
                     else:
                         self.worksheet.set_column(col, col, width)
-                self.worksheet.write(row, col, header['label'], fmt)
+                self.write(row, col, header['label'], fmt)
                 col += 1
 
 
@@ -64,9 +114,15 @@ class Report(object):
         self.config = config
         self.name = self.config['name']
         self._file_name = '{}.xlsx'.format(self.name)
-        self._workbook = xlsxwriter.Workbook(self._file_name)
+        # In constant memory mode each row is written out as soon as a
+        # later row is started, rather than the whole workbook being
+        # kept in memory until it is closed.
+        self.constant_memory = self.config.get('constant_memory', False)
+        self._workbook = xlsxwriter.Workbook(
+            self._file_name, {'constant_memory': self.constant_memory})
         self._formats = {}
         self._pages = {}
+        self._current_page = None
         self.add_formats(config['formats'])
 
     @property
@@ -74,8 +130,16 @@ class Report(object):
         return self._workbook
 
     def close(self):
+        self._finish_page()
         self._workbook.close()
 
+    def _finish_page(self):
+        # Called when the current page is done, before the next one is
+        # created or the workbook is closed.
+        if self._current_page is not None:
+            self._current_page.flush()
+            self._current_page = None
+
     def get_format(self, name):
         return self._formats[name]
 
@@ -83,8 +147,11 @@ class Report(object):
         return self._pages[name]
 
     def create_page(self, name):
+        self._finish_page()
         worksheet = self._workbook.add_worksheet(name)
-        self._pages[name] = Page(name, self, worksheet)
+        self._pages[name] = Page(
+            name, self, worksheet, buffered=self.constant_memory)
+        self._current_page = self._pages[name]
         return self._pages[name]
 
     def add_formats(self, formats):
@@ -11,6 +11,7 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import bisect
 import datetime
 import calendar
 
@@ -18,8 +19,14 @@ from dateutil.tz import tzlocal, tzutc
 import dateutil.parser
 import pytz
 
+from skinflint import stats
+from skinflint.billreader import ReportReader
 from skinflint.metric import TotalUsage, InstanceCost, DataTransfer
 
+Metrics = (TotalUsage, InstanceCost, DataTransfer)
+
+OneDay = datetime.timedelta(days=1)
+
 
 # The following utility functions were copied directly from botocore.utils
 
@@ -51,30 +58,71 @@ def parse_to_aware_datetime(value):
     return datetime_obj
 
 
+# Billing reports use a single timestamp format and only have a few
+# hundred distinct timestamps a month, so those are parsed directly and
+# remembered.  This also means slices share their datetime objects.
+TimestampCacheSize = 4096
+_UTC = tzutc()
+_timestamps = {}
+
+
+def parse_report_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return parse_to_aware_datetime(value)
+    timestamp = _timestamps.get(value)
+    if timestamp is not None:
+        return timestamp
+    if (len(value) == 19 and value[4] == '-' and value[7] == '-' and
+            value[10] == ' ' and value[13] == ':' and value[16] == ':'):
+        try:
+            timestamp = datetime.datetime(
+                int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                tzinfo=_UTC)
+        except ValueError:
+            pass
+    if timestamp is None:
+        timestamp = parse_to_aware_datetime(value)
+    if len(_timestamps) >= TimestampCacheSize:
+        _timestamps.clear()
+    _timestamps[value] = timestamp
+    return timestamp
+
+
 class Slice(object):
 
+    # A SuperSlice holds thousands of these, so they have no __dict__
+    __slots__ = ('start', 'end', '_lineitems', 'metrics')
+
     def __init__(self, start, end, retain_lineitems=False):
         if start:
-            self.start = parse_to_aware_datetime(start)
+            self.start = parse_report_timestamp(start)
         else:
             self.start = start
         if end:
-            self.end = parse_to_aware_datetime(end)
+            self.end = parse_report_timestamp(end)
         else:
             self.end = end
-        self._retain_lineitems = retain_lineitems
-        self._lineitems = []
-        self.metrics = [TotalUsage(), InstanceCost(), DataTransfer()]
+        self._lineitems = None
+        if retain_lineitems:
+            self._lineitems = []
+        self.metrics = [metric_cls() for metric_cls in Metrics]
+
+    def __getstate__(self):
+        return (self.start, self.end, self._lineitems, self.metrics)
+
+    def __setstate__(self, state):
+        self.start, self.end, self._lineitems, self.metrics = state
 
     def __add__(self, other):
         for metric, other_metric in zip(self.metrics, other.metrics):
             metric + other_metric
 
-    def add_lineitem(self, lineitem):
-        if self._retain_lineitems:
+    def add_lineitem(self, lineitem, keys=None):
+        if self._lineitems is not None:
             self._lineitems.append(lineitem)
         for metric in self.metrics:
-            metric.add(lineitem)
+            metric.add(lineitem, keys)
 
     @property
     def metric_names(self):
@@ -83,8 +131,25 @@ class Slice(object):
 
 class SuperSlice(object):
 
+    Columns = ('RateId', 'UsageStartDate', 'UsageEndDate')
+
     def __init__(self, now=None):
         self.slices = {}
+        # A time index over self.slices.  _bounds holds the (start, end)
+        # of each slice in sorted order and _timeline the slices in the
+        # same order, so a window can be found with bisect.
+        self._bounds = []
+        self._timeline = []
+        # Rollups of the slices that fall within a single UTC day, per
+        # day and per month, plus the slices that cross midnight and so
+        # are not part of any rollup, by (start, end).
+        self._days = {}
+        self._months = {}
+        self._spanning = {}
+        # The contributions to each slice key by source, and the keys and
+        # non-lineitem slices each source contributed.
+        self._contributions = {}
+        self._sources = {}
         self.non_lineitems = []
         self.onetime_charges = []
         self.start = None
@@ -93,71 +158,322 @@ class SuperSlice(object):
         if self.now is None:
             self.now = pytz.utc.localize(datetime.datetime.utcnow())
 
-    def add(self, new_slice):
+    def add(self, new_slice, source=None):
+        # Every slice is recorded as a contribution from a source (None
+        # if it has none) so that a source can later be removed or
+        # replaced.  While a key has a single contribution that Slice is
+        # also the one in self.slices, otherwise self.slices holds a
+        # separate Slice with the sum of the contributions.
         if not new_slice.start and not new_slice.end:
             self.non_lineitems.append(new_slice)
+            if source is not None:
+                self._source(source)[1].append(new_slice)
+            return
+        if self.start is None:
+            self.start = new_slice.start
+        elif self.start > new_slice.start:
+            self.start = new_slice.start
+        if self.end is None:
+            self.end = new_slice.end
+        elif self.end < new_slice.end:
+            self.end = new_slice.end
+        slice_key = '%s-%s' % (new_slice.start, new_slice.end)
+        contributions = self._contributions.get(slice_key)
+        if contributions is None:
+            self._contributions[slice_key] = {source: new_slice}
+            self.slices[slice_key] = new_slice
+            bounds = (new_slice.start, new_slice.end)
+            i = bisect.bisect_left(self._bounds, bounds)
+            self._bounds.insert(i, bounds)
+            self._timeline.insert(i, new_slice)
+            if self._is_spanning(new_slice):
+                self._spanning[bounds] = new_slice
+        elif source in contributions:
+            contributions[source] + new_slice
+            if len(contributions) > 1:
+                self.slices[slice_key] + new_slice
         else:
-            if self.start is None:
-                self.start = new_slice.start
-            elif self.start > new_slice.start:
-                self.start = new_slice.start
-            if self.end is None:
-                self.end = new_slice.end
-            elif self.end < new_slice.end:
-                self.end = new_slice.end
-            slice_key = '%s-%s' % (new_slice.start, new_slice.end)
-            if slice_key not in self.slices:
-                self.slices[slice_key] = new_slice
+            if len(contributions) == 1:
+                combined = Slice(new_slice.start, new_slice.end)
+                for contribution in contributions.values():
+                    combined + contribution
+                self._set_combined(slice_key, combined)
+            contributions[source] = new_slice
+            self.slices[slice_key] + new_slice
+        if source is not None:
+            self._source(source)[0].add(slice_key)
+        self._rollup(new_slice)
+
+    def _source(self, source):
+        # The slice keys and non-lineitem slices contributed by source
+        if source not in self._sources:
+            self._sources[source] = (set(), [])
+        return self._sources[source]
+
+    def _set_combined(self, slice_key, combined):
+        old = self.slices[slice_key]
+        self.slices[slice_key] = combined
+        i = bisect.bisect_left(self._bounds, (old.start, old.end))
+        self._timeline[i] = combined
+        if self._is_spanning(old):
+            self._spanning[(old.start, old.end)] = combined
+
+    def _is_spanning(self, new_slice):
+        return new_slice.end > _start_of_day(new_slice.start) + OneDay
+
+    def _rollup(self, new_slice):
+        if self._is_spanning(new_slice):
+            return
+        day = _start_of_day(new_slice.start)
+        self._rollup_day(day, new_slice)
+        self._rollup_month(day, new_slice)
+
+    def _rollup_day(self, day, new_slice):
+        if day not in self._days:
+            self._days[day] = Slice(day, day + OneDay)
+        self._days[day] + new_slice
+
+    def _rollup_month(self, day, new_slice):
+        month = (day.year, day.month)
+        if month not in self._months:
+            month_start = day.replace(day=1)
+            self._months[month] = Slice(month_start, _next_month(month_start))
+        self._months[month] + new_slice
+
+    def _rebuild_rollups(self, days):
+        months = set()
+        for day in days:
+            self._days.pop(day, None)
+            for new_slice in self.window(day, day + OneDay):
+                if (new_slice.start < day + OneDay and
+                        not self._is_spanning(new_slice)):
+                    self._rollup_day(day, new_slice)
+            months.add((day.year, day.month))
+        for year, month in months:
+            self._months.pop((year, month), None)
+            for day in self._days:
+                if day.year == year and day.month == month:
+                    self._rollup_month(day, self._days[day])
+
+    def remove(self, source):
+        # Take out everything that was added from source.
+        if source not in self._sources:
+            return
+        slice_keys, non_lineitems = self._sources.pop(source)
+        for new_slice in non_lineitems:
+            for i in range(0, len(self.non_lineitems)):
+                if self.non_lineitems[i] is new_slice:
+                    del self.non_lineitems[i]
+                    break
+        days = set()
+        for slice_key in slice_keys:
+            contributions = self._contributions[slice_key]
+            old = contributions.pop(source)
+            if not self._is_spanning(old):
+                days.add(_start_of_day(old.start))
+            if not contributions:
+                del self._contributions[slice_key]
+                del self.slices[slice_key]
+                i = bisect.bisect_left(self._bounds, (old.start, old.end))
+                del self._bounds[i]
+                del self._timeline[i]
+                if self._is_spanning(old):
+                    del self._spanning[(old.start, old.end)]
+            elif len(contributions) == 1:
+                self._set_combined(slice_key, list(contributions.values())[0])
             else:
-                self.slices[slice_key] + new_slice
-
-    def load(self, billreader):
+                combined = Slice(old.start, old.end)
+                for contribution in contributions.values():
+                    combined + contribution
+                self._set_combined(slice_key, combined)
+        self._rebuild_rollups(days)
+        if self._bounds:
+            self.start = self._bounds[0][0]
+            self.end = max([bounds[1] for bounds in self._bounds])
+        else:
+            self.start = None
+            self.end = None
+
+    def merge(self, other, source=None):
+        # The slices of other are taken over as they are, so other
+        # should not be used once it has been merged.  If a source is
+        # given it replaces anything previously merged or loaded from
+        # that source.
+        if source is not None:
+            self.remove(source)
+        for new_slice in other.non_lineitems:
+            self.add(new_slice, source)
+        for slice_key in other.slices:
+            self.add(other.slices[slice_key], source)
+        self.onetime_charges.extend(other.onetime_charges)
+
+    def timeline(self, granularity='hour'):
+        # The slices in time order, either every slice as it was loaded
+        # ('hour') or the daily rollups plus the slices crossing
+        # midnight, which are not part of any day ('day').  Slices
+        # without a usage period are not included.
+        if granularity == 'hour':
+            return list(self._timeline)
+        if granularity == 'day':
+            pieces = list(self._days.values())
+            pieces.extend(self._spanning.values())
+            pieces.sort(key=lambda s: (s.start, s.end))
+            return pieces
+        raise ValueError('Unknown granularity (%s)' % granularity)
+
+    def columns(self):
+        columns = list(self.Columns)
+        for metric_cls in Metrics:
+            for column in metric_cls.Columns:
+                if column not in columns:
+                    columns.append(column)
+        return columns
+
+    def _prepare(self, billreader, source):
+        # Returns the source of what is loaded from billreader, which
+        # defaults to the path of the report.
+        if isinstance(billreader, ReportReader):
+            if billreader.columns is None:
+                billreader.project(self.columns())
+            billreader.fixed_point = True
+            if source is None:
+                source = billreader.filepath
+        return source
+
+    def load(self, billreader, source=None):
+        # Loading is idempotent: the slices loaded from a source replace
+        # whatever was loaded from that source before instead of adding
+        # to it.
+        source = self._prepare(billreader, source)
+        # Rows are grouped into slices by looking up their usage period,
+        # so the order of the rows in the report does not matter.  Rows
+        # with a RateId of 0 belong to the slice of the row before them.
+        buckets = {}
         new_slice = None
-        start = None
-        end = None
-        done = False
-        while not done:
-            try:
-                lineitem = next(billreader)
-            except StopIteration:
-                done = True
-                continue
-            usage_start = lineitem['UsageStartDate']
-            usage_end = lineitem['UsageEndDate']
-            if lineitem['RateId'] != '0':
-                if usage_start != start or usage_end != end:
-                    if new_slice:
-                        self.add(new_slice)
-                    start = usage_start
-                    end = usage_end
-                    new_slice = Slice(start, end)
-            new_slice.add_lineitem(lineitem)
-        if new_slice:
-            self.add(new_slice)
+        rows = 0
+        # The dimension keys of this load, shared by all of its slices
+        keys = {}
+        with stats.timer('superslice.load.rows'):
+            for rows, lineitem in enumerate(billreader, 1):
+                if lineitem['RateId'] != '0' or new_slice is None:
+                    bucket_key = (lineitem['UsageStartDate'],
+                                  lineitem['UsageEndDate'])
+                    new_slice = buckets.get(bucket_key)
+                    if new_slice is None:
+                        new_slice = Slice(bucket_key[0], bucket_key[1])
+                        buckets[bucket_key] = new_slice
+                new_slice.add_lineitem(lineitem, keys)
+        slices = list(buckets.values())
+        stats.incr('superslice.rows', rows)
+        self._add_loaded(slices, source)
+
+    def _add_loaded(self, slices, source):
+        with stats.timer('superslice.load.add'):
+            if source is not None:
+                self.remove(source)
+            for new_slice in slices:
+                self.add(new_slice, source)
+        if stats.enabled():
+            stats.incr('superslice.loads')
+            stats.incr('superslice.slices', len(slices))
+            for new_slice in slices:
+                for metric in new_slice.metrics:
+                    stats.incr('metric.%s.keys' % metric.__class__.__name__,
+                               len(metric._data))
 
     def metrics(self):
         metrics = []
-        if self.slices:
-            metrics = self.slices[0].metrics
+        if self._timeline:
+            metrics = self._timeline[0].metrics
         return metrics
 
+    def window(self, start, end):
+        # All of the slices that start at or after start and end at or
+        # before end, in time order.
+        slices = []
+        if not self._bounds:
+            return slices
+        i = bisect.bisect_left(self._bounds, (start,))
+        n = len(self._bounds)
+        while i < n and self._bounds[i][0] <= end:
+            if self._bounds[i][1] <= end:
+                slices.append(self._timeline[i])
+            i += 1
+        return slices
+
+    def _pieces(self, start, end):
+        # The slices and rollups that add up to the aggregate of the
+        # window.  Whole months and days inside the window come from the
+        # rollups and only the partial days at either end, plus any
+        # slices crossing midnight, come from the time index.
+        if not self._bounds:
+            return []
+        first_day = _start_of_day(start)
+        if first_day < start:
+            first_day += OneDay
+        last_day = _start_of_day(end)
+        if first_day >= last_day:
+            return self.window(start, end)
+        spanning = self._spanning
+        pieces = [s for s in self.window(start, first_day)
+                  if s.start < first_day and (s.start, s.end) not in spanning]
+        day = first_day
+        while day < last_day:
+            next_month = _next_month(day)
+            if day.day == 1 and next_month <= last_day:
+                block = self._months.get((day.year, day.month))
+                day = next_month
+            else:
+                block = self._days.get(day)
+                day += OneDay
+            if block is not None:
+                pieces.append(block)
+        pieces.extend([s for s in self.window(last_day, end)
+                       if (s.start, s.end) not in spanning])
+        pieces.extend([s for s in spanning.values()
+                       if s.start >= start and s.end <= end])
+        return pieces
+
+    @stats.timed('superslice.aggregate')
     def aggregate(self, start, end):
         aggregate_slice = Slice(start, end)
-        for slice_key in self.slices:
-            new_slice = self.slices[slice_key]
-            if new_slice.start >= start and new_slice.end <= end:
-                aggregate_slice + new_slice
+        for piece in self._pieces(start, end):
+            aggregate_slice + piece
         return aggregate_slice
 
+    @stats.timed('superslice.aggregate_many')
+    def aggregate_many(self, windows):
+        # windows maps names to (start, end) and the result maps the same
+        # names to aggregated Slices.  Each slice or rollup that a window
+        # needs is looked up once and added to every window containing
+        # it, and windows with the same bounds share a single Slice.
+        aggregates = {}
+        pieces = {}
+        for start, end in set(windows.values()):
+            aggregates[(start, end)] = Slice(start, end)
+            for piece in self._pieces(start, end):
+                if id(piece) in pieces:
+                    pieces[id(piece)][1].append((start, end))
+                else:
+                    pieces[id(piece)] = (piece, [(start, end)])
+        for piece, bounds in pieces.values():
+            for window in bounds:
+                aggregates[window] + piece
+        return dict((name, aggregates[window])
+                    for name, window in windows.items())
+
     def all(self):
         return self.aggregate(self.start, self.end)
 
-    def _slice_a_day(self, days_ago):
+    def _day_window(self, days_ago):
         now = self.now - days_ago
         start = datetime.datetime(now.year, now.month, now.day)
         start = pytz.utc.localize(start)
         end = start + datetime.timedelta(hours=23, minutes=59, seconds=59)
-        return self.aggregate(start, end)
+        return start, end
+
+    def _slice_a_day(self, days_ago):
+        return self.aggregate(*self._day_window(days_ago))
 
     def latest(self):
         one_day = datetime.timedelta(hours=24)
@@ -175,22 +491,26 @@ class SuperSlice(object):
         one_month = datetime.timedelta(hours=24 * 29)
         return self._slice_a_day(one_month)
 
-    def month(self, year, month):
+    def _month_window(self, year, month):
         month_start = pytz.utc.localize(
             datetime.datetime(year, month, 1))
-        month_end = pytz.utc.localize(
-            datetime.datetime(year, month + 1, 1, 0, 0, 0))
-        return self.aggregate(month_start, month_end)
+        return month_start, _next_month(month_start)
+
+    def month(self, year, month):
+        return self.aggregate(*self._month_window(year, month))
 
     def this_month(self):
         return self.month(self.now.year, self.now.month)
 
+    def _last_month(self):
+        return self.now - datetime.timedelta(days=self.now.day + 1)
+
     def last_month(self):
-        then = self.now - datetime.timedelta(days=self.now.day + 1)
+        then = self._last_month()
         return self.month(then.year, then.month)
 
-    def last_month_to_date(self):
-        then = self.now - datetime.timedelta(days=self.now.day + 1)
+    def _last_month_to_date_window(self):
+        then = self._last_month()
         _, ndays = calendar.monthrange(then.year, then.month)
         month_start = pytz.utc.localize(
             datetime.datetime(then.year, then.month, 1))
@@ -198,7 +518,41 @@ class SuperSlice(object):
             datetime.datetime(then.year, then.month,
                               min(self.now.day, ndays),
                               self.now.hour, self.now.minute))
-        return self.aggregate(month_start, month_end)
+        return month_start, month_end
+
+    def last_month_to_date(self):
+        return self.aggregate(*self._last_month_to_date_window())
+
+    def report_windows(self):
+        # The windows of the daily report by name, for aggregate_many
+        then = self._last_month()
+        return {
+            'latest': self._day_window(datetime.timedelta(hours=24)),
+            'one_day_ago': self._day_window(datetime.timedelta(hours=48)),
+            'one_week_ago': self._day_window(
+                datetime.timedelta(hours=24 * 8)),
+            'one_month_ago': self._day_window(
+                datetime.timedelta(hours=24 * 29)),
+            'this_month': self._month_window(self.now.year, self.now.month),
+            'last_month': self._month_window(then.year, then.month),
+            'last_month_to_date': self._last_month_to_date_window()}
+
+
+def _start_of_day(timestamp):
+    timestamp = timestamp.astimezone(tzutc())
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(timestamp):
+    if timestamp.month == 12:
+        return timestamp.replace(year=timestamp.year + 1, month=1, day=1)
+    return timestamp.replace(month=timestamp.month + 1, day=1)
+
+
+def previous_month(timestamp):
+    if timestamp.month == 1:
+        return timestamp.replace(year=timestamp.year - 1, month=12, day=1)
+    return timestamp.replace(month=timestamp.month - 1, day=1)
 
 
 def slicer(billreader):
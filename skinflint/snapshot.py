@@ -0,0 +1,193 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import os
+import hashlib
+import logging
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from skinflint import stats
+from skinflint.billreader import DetailedBillReportReader, open_report_bytes
+from skinflint.parallel import load_report
+from skinflint.slice import Metrics, Slice, SuperSlice
+
+LOG = logging.getLogger(__name__)
+
+# A snapshot holds the per-slice metric totals that SuperSlice.load
+# produced for one billing file.  It is stored next to that file as two
+# pickles: a small header with the fingerprint of the source file,
+# followed by the slices.  Only plain tuples, dicts and datetimes are
+# pickled so a snapshot does not depend on the layout of our classes.
+#
+# The header also records how many bytes of the report were parsed and
+# a digest of those bytes.  AWS keeps appending to the current month's
+# report, so when the report has changed but still starts with the same
+# bytes only the new tail has to be parsed.
+SnapshotVersion = 2
+
+
+def snapshot_path(file_path):
+    return file_path + '.snapshot'
+
+
+def fingerprint(file_path, etag=None):
+    st = os.stat(file_path)
+    return {'size': st.st_size,
+            'mtime': st.st_mtime,
+            'etag': etag}
+
+
+def _header(source_fingerprint, offset=None, digest=None):
+    return {'version': SnapshotVersion,
+            'metrics': [metric_cls.__name__ for metric_cls in Metrics],
+            'fingerprint': source_fingerprint,
+            'offset': offset,
+            'digest': digest}
+
+
+def report_digests(file_path, offset=None):
+    # Returns the digest of the first offset bytes of the report (None
+    # if the report is shorter than that), the digest of the whole
+    # report and its size, all computed in a single read.
+    sha = hashlib.sha1()
+    prefix_digest = None
+    size = 0
+    fp = open_report_bytes(file_path)
+    try:
+        while True:
+            chunk_size = 1024 * 1024
+            if offset is not None and size < offset:
+                chunk_size = min(chunk_size, offset - size)
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+            size += len(chunk)
+            if size == offset:
+                prefix_digest = sha.hexdigest()
+    finally:
+        fp.close()
+    if offset == 0:
+        prefix_digest = hashlib.sha1().hexdigest()
+    return prefix_digest, sha.hexdigest(), size
+
+
+def _dump_slice(new_slice):
+    return (new_slice.start, new_slice.end,
+            [list(metric._data.items()) for metric in new_slice.metrics])
+
+
+def _load_slice(start, end, metrics_data):
+    new_slice = Slice(start, end)
+    for metric, items in zip(new_slice.metrics, metrics_data):
+        for key, value in items:
+            metric.add_cost(key, value)
+    return new_slice
+
+
+def save(superslice, file_path, source_fingerprint, offset=None,
+         digest=None):
+    path = snapshot_path(file_path)
+    tmp_path = path + '.tmp'
+    slices = [_dump_slice(s) for s in superslice.non_lineitems]
+    slices.extend([_dump_slice(s) for s in superslice.slices.values()])
+    header = _header(source_fingerprint, offset, digest)
+    fp = open(tmp_path, 'wb')
+    try:
+        pickle.dump(header, fp, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(slices, fp, pickle.HIGHEST_PROTOCOL)
+    finally:
+        fp.close()
+    os.rename(tmp_path, path)
+    LOG.debug('saved snapshot %s', path)
+
+
+def _read(file_path):
+    path = snapshot_path(file_path)
+    if not os.path.isfile(path):
+        return None, None
+    fp = open(path, 'rb')
+    try:
+        try:
+            header = pickle.load(fp)
+            current = _header(None)
+            if not isinstance(header, dict) or any(
+                    header.get(k) != current[k]
+                    for k in ('version', 'metrics')):
+                LOG.debug('snapshot %s has an old format', path)
+                return None, None
+            # A truncated or damaged body means a reparse, like a
+            # damaged header
+            return header, pickle.load(fp)
+        except Exception:
+            LOG.debug('unreadable snapshot %s', path)
+            return None, None
+    finally:
+        fp.close()
+
+
+def _superslice(slices, now):
+    ss = SuperSlice(now)
+    for start, end, metrics_data in slices:
+        ss.add(_load_slice(start, end, metrics_data))
+    return ss
+
+
+def load(file_path, source_fingerprint, now=None):
+    header, slices = _read(file_path)
+    if header is None or header['fingerprint'] != source_fingerprint:
+        return None
+    LOG.debug('loaded snapshot %s', snapshot_path(file_path))
+    return _superslice(slices, now)
+
+
+def refresh(file_path, source_fingerprint, now=None, workers=1,
+            superslice_cls=SuperSlice):
+    # Returns a SuperSlice loaded with the report at file_path, using
+    # and updating its snapshot.  A report that has to be parsed in
+    # full is parsed in up to workers processes.  Parsing is done with
+    # superslice_cls.load.
+    header, slices = _read(file_path)
+    if header is not None and header['fingerprint'] == source_fingerprint:
+        LOG.debug('loaded snapshot %s', snapshot_path(file_path))
+        stats.incr('snapshot.hits')
+        return _superslice(slices, now)
+    offset = None
+    if header is not None:
+        offset = header['offset']
+    with stats.timer('snapshot.digest'):
+        prefix_digest, digest, size = report_digests(file_path, offset)
+    if prefix_digest is not None and prefix_digest == header['digest']:
+        LOG.debug('parsing %s from byte %d', file_path, offset)
+        stats.incr('snapshot.tails')
+        stats.incr('snapshot.parsed_bytes', size - offset)
+        ss = _superslice(slices, now)
+        tail = superslice_cls(now)
+        dbr = DetailedBillReportReader(file_path, offset=offset)
+        try:
+            tail.load(dbr)
+        finally:
+            dbr.close()
+        ss.merge(tail)
+    else:
+        LOG.debug('parsing all of %s', file_path)
+        stats.incr('snapshot.misses')
+        stats.incr('snapshot.parsed_bytes', size)
+        ss = load_report(file_path, workers, now, superslice_cls)
+    with stats.timer('snapshot.save'):
+        save(ss, file_path, source_fingerprint, size, digest)
+    return ss
@@ -0,0 +1,182 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+# Opt-in counters and timings of the slow parts of building a report.
+# Nothing is recorded until enable() is called, and while disabled every
+# function here returns after checking a single flag.  Counts are taken
+# per file, load or call rather than per row, so even when enabled the
+# cost is small.
+#
+#     >>> from skinflint import stats
+#     >>> stats.enable()
+#     >>> ... build a report ...
+#     >>> stats.snapshot()
+#     {'counters': {'superslice.rows': 1234, 'reader.rows': 1234, ...},
+#      'timings': {'superslice.load.rows': {'count': 2, 'seconds': 1.5},
+#                  ...}}
+#
+# superslice.rows counts the line items loaded and reader.rows the rows
+# read after the header, whatever the number of physical lines they
+# take up.
+#
+# Functions passed to add_hook are called with (kind, name, value) for
+# every counter ('counter', value added) and timing ('timing', seconds).
+# Stats are per process: a worker of a process pool runs its work with
+# collect() and returns the stats along with its result, which the
+# parent then adds to its own with merge().
+
+import functools
+import json
+import time
+
+_enabled = False
+_counters = {}
+_timings = {}
+_hooks = []
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    _counters.clear()
+    _timings.clear()
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def incr(name, value=1):
+    if not _enabled:
+        return
+    _counters[name] = _counters.get(name, 0) + value
+    for hook in _hooks:
+        hook('counter', name, value)
+
+
+def record(name, seconds):
+    if not _enabled:
+        return
+    timing = _timings.get(name)
+    if timing is None:
+        timing = _timings[name] = [0, 0.0]
+    timing[0] += 1
+    timing[1] += seconds
+    for hook in _hooks:
+        hook('timing', name, seconds)
+
+
+class _Timer(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.name, time.time() - self.start)
+        return False
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_timer = _NullTimer()
+
+
+def timer(name):
+    if not _enabled:
+        return _null_timer
+    return _Timer(name)
+
+
+def timed(name):
+    # A decorator that records the time of every call of a function
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def collect(fn, args, enable=True):
+    # Calls fn(*args) with stats of its own and returns (result, stats)
+    # where stats is the snapshot() of the call, or None if stats are
+    # disabled.  enable is whether stats are enabled in the parent,
+    # since a worker process does not always start out as a copy of it.
+    global _enabled, _counters, _timings, _hooks
+    saved = _enabled, _counters, _timings, _hooks
+    _enabled, _counters, _timings, _hooks = enable, {}, {}, []
+    try:
+        result = fn(*args)
+        collected = None
+        if enable:
+            collected = snapshot()
+        return result, collected
+    finally:
+        _enabled, _counters, _timings, _hooks = saved
+
+
+def merge(collected):
+    # Adds the stats returned by collect() to the stats of this process
+    if not _enabled or not collected:
+        return
+    for name, value in sorted(collected['counters'].items()):
+        incr(name, value)
+    for name, other in sorted(collected['timings'].items()):
+        timing = _timings.get(name)
+        if timing is None:
+            timing = _timings[name] = [0, 0.0]
+        timing[0] += other['count']
+        timing[1] += other['seconds']
+        for hook in _hooks:
+            hook('timing', name, other['seconds'])
+
+
+def snapshot():
+    return {'counters': dict(_counters),
+            'timings': dict((name, {'count': t[0], 'seconds': t[1]})
+                            for name, t in _timings.items())}
+
+
+def dump(fp):
+    json.dump(snapshot(), fp, indent=2, sort_keys=True)
@@ -0,0 +1,110 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import os
+import decimal
+import shutil
+import tempfile
+import zipfile
+
+from skinflint.billreader import DetailedBillReportReader, LineItem
+from skinflint.slice import SuperSlice
+from tests.unit.util import SuperSliceAssertions, get_billing_filepath
+
+
+class TestReportReader(unittest.TestCase):
+
+    def setUp(self):
+        self.dbr = DetailedBillReportReader(get_billing_filepath('test.csv'))
+
+    def test_headers(self):
+        self.assertEqual(len(self.dbr.headers), 24)
+        self.assertEqual(self.dbr.index['InvoiceID'], 0)
+        self.assertEqual(self.dbr.index['user:Role'], 23)
+
+    def test_lineitem(self):
+        lineitem = next(self.dbr)
+        self.assertIsInstance(lineitem, LineItem)
+        self.assertEqual(lineitem['LinkedAccountId'], '012345678901')
+        self.assertEqual(lineitem['UsageStartDate'], '2015-03-01 00:00:00')
+        self.assertEqual(lineitem['BlendedCost'], decimal.Decimal('0'))
+        self.assertEqual(lineitem['user:Role'], '')
+        self.assertIn('RateId', lineitem)
+        self.assertNotIn('Foo', lineitem)
+        self.assertEqual(lineitem.get('Foo', 'bar'), 'bar')
+        self.assertRaises(KeyError, lambda: lineitem['Foo'])
+
+    def test_lineitem_shares_index(self):
+        first = next(self.dbr)
+        second = next(self.dbr)
+        self.assertIs(first._index, second._index)
+        self.assertEqual(first.as_dict()['UsageStartDate'],
+                         '2015-03-01 00:00:00')
+        self.assertEqual(second.as_dict()['UsageStartDate'],
+                         '2015-03-01 01:00:00')
+
+    def test_all_lineitems(self):
+        lineitems = list(self.dbr)
+        self.assertEqual(len(lineitems), 23)
+        total = sum([lineitem['BlendedCost'] for lineitem in lineitems])
+        self.assertEqual(total, decimal.Decimal('3.28367611'))
+
+    def test_projection(self):
+        dbr = DetailedBillReportReader(
+            get_billing_filepath('test.csv'),
+            columns=['BlendedCost', 'LinkedAccountId', 'NotAColumn'])
+        self.assertEqual(dbr.columns, ['LinkedAccountId', 'BlendedCost'])
+        lineitem = next(dbr)
+        self.assertEqual(len(lineitem), 2)
+        self.assertEqual(lineitem['LinkedAccountId'], '012345678901')
+        self.assertEqual(lineitem['BlendedCost'], decimal.Decimal('0'))
+        self.assertNotIn('UnBlendedCost', lineitem)
+        self.assertNotIn('NotAColumn', lineitem)
+
+    def test_superslice_projection(self):
+        ss = SuperSlice()
+        ss.load(self.dbr)
+        self.assertEqual(
+            sorted(self.dbr.columns),
+            sorted(['RateId', 'UsageStartDate', 'UsageEndDate',
+                    'LinkedAccountId', 'ProductName', 'UsageType',
+                    'BlendedCost']))
+        self.assertEqual(len(ss.slices), 3)
+
+
+class TestZippedReportReader(SuperSliceAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.tmpdir, 'test.csv.zip')
+        zf = zipfile.ZipFile(self.zip_path, 'w', zipfile.ZIP_DEFLATED)
+        zf.write(get_billing_filepath('test.csv'), 'test.csv')
+        zf.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_zip(self):
+        dbr = DetailedBillReportReader(self.zip_path)
+        self.assertEqual(len(dbr.headers), 24)
+        lineitems = list(dbr)
+        dbr.close()
+        self.assertEqual(len(lineitems), 23)
+        self.assertEqual(lineitems[0]['LinkedAccountId'], '012345678901')
+
+    def test_slice_zip(self):
+        ss = SuperSlice()
+        ss.load(DetailedBillReportReader(self.zip_path))
+        plain = SuperSlice()
+        plain.load(DetailedBillReportReader(get_billing_filepath('test.csv')))
+        self.assertSuperSlicesEqual(ss, plain)
@@ -0,0 +1,99 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import csv
+import os
+import random
+import shutil
+import tempfile
+
+from skinflint import columnar
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.metric import to_fixed
+from skinflint.slice import SuperSlice
+from tests.unit.util import SuperSliceAssertions, get_billing_filepath
+
+
+@unittest.skipIf(columnar.numpy is None, 'numpy is not installed')
+class TestColumnarSuperSlice(SuperSliceAssertions, unittest.TestCase):
+
+    def test_load(self):
+        path = get_billing_filepath('test.csv')
+        ss = SuperSlice()
+        ss.load(DetailedBillReportReader(path))
+        columnar_ss = columnar.ColumnarSuperSlice()
+        columnar_ss.load(DetailedBillReportReader(path))
+        self.assertSuperSlicesEqual(columnar_ss, ss)
+        total = columnar_ss.aggregate(columnar_ss.start, columnar_ss.end)
+        expected = ss.aggregate(ss.start, ss.end)
+        for metric1, metric2 in zip(total.metrics, expected.metrics):
+            self.assertEqual(metric1.data, metric2.data)
+
+    def test_unsorted_rows(self):
+        dbr = DetailedBillReportReader(get_billing_filepath('test.csv'))
+        lineitems = [lineitem.as_dict() for lineitem in dbr]
+        rnd = random.Random(7)
+        rnd.shuffle(lineitems)
+        ss = SuperSlice()
+        ss.load(iter(lineitems))
+        columnar_ss = columnar.ColumnarSuperSlice()
+        columnar_ss.load(iter(lineitems))
+        self.assertSuperSlicesEqual(columnar_ss, ss)
+
+    def test_reload(self):
+        path = get_billing_filepath('test.csv')
+        ss = columnar.ColumnarSuperSlice()
+        ss.load(DetailedBillReportReader(path))
+        expected = dict((k, [m.data for m in s.metrics])
+                        for k, s in ss.slices.items())
+        ss.load(DetailedBillReportReader(path))
+        self.assertEqual(dict((k, [m.data for m in s.metrics])
+                              for k, s in ss.slices.items()), expected)
+
+    def test_chunks(self):
+        # Rows with a RateId of 0 belong to the period of the row before
+        # them, also across chunks
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'rate0.csv')
+            fp = open(get_billing_filepath('test.csv'))
+            lines = list(csv.reader(fp))
+            fp.close()
+            headers = lines[0]
+            for i in range(2, len(lines) - 1, 3):
+                for column in ('RateId', 'UsageStartDate', 'UsageEndDate'):
+                    lines[i][headers.index(column)] = ''
+                lines[i][headers.index('RateId')] = '0'
+            fp = open(path, 'w')
+            csv.writer(fp).writerows(lines)
+            fp.close()
+            ss = SuperSlice()
+            ss.load(DetailedBillReportReader(path))
+            for chunk_size in (1, 2, 5, columnar.ChunkSize):
+                chunk_size, columnar.ChunkSize = (columnar.ChunkSize,
+                                                  chunk_size)
+                try:
+                    columnar_ss = columnar.ColumnarSuperSlice()
+                    columnar_ss.load(DetailedBillReportReader(path))
+                finally:
+                    columnar.ChunkSize = chunk_size
+                self.assertSuperSlicesEqual(columnar_ss, ss)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_fixed_costs(self):
+        values = ['0.13200000', '12', '-0.5', '.25', '1E-8', '0.000000015',
+                  '0.000000025', '12345678.12345678', '1.89673919']
+        self.assertEqual(columnar.fixed_costs(values).tolist(),
+                         [to_fixed(v) for v in values])
+        self.assertRaises(ValueError, columnar.fixed_costs, ['1', ''])
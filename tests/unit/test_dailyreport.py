@@ -0,0 +1,66 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import datetime
+import decimal
+
+import pytz
+
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.dailyreport import AccountCollection, report_requests
+from skinflint.slice import SuperSlice
+from tests.unit.util import get_billing_filepath
+
+
+class TestAccountCollection(unittest.TestCase):
+
+    def setUp(self):
+        now = pytz.utc.localize(datetime.datetime(2015, 3, 2, 12))
+        ss = SuperSlice(now)
+        ss.load(DetailedBillReportReader(get_billing_filepath('test.csv')))
+        self.ac = AccountCollection(
+            ss, {'012345678901': {'name': 'Foo'}})
+
+    def test_accounts(self):
+        self.assertEqual(sorted(self.ac.totals),
+                         ['012345678901', '234567890123', 'AllAccounts'])
+        self.assertEqual(self.ac.totals['012345678901'].name, 'Foo')
+        self.assertEqual(self.ac.totals['234567890123'].name,
+                         '234567890123')
+
+    def test_usage(self):
+        account = self.ac.totals['234567890123']
+        self.assertEqual(account.usage['latest'],
+                         {'SQS': decimal.Decimal('0.48793206'),
+                          'DynamoDB': decimal.Decimal('1.89673919'),
+                          'EC2': decimal.Decimal('0.28500000')})
+        self.assertEqual(account.sort_label('latest')[0][0], 'DynamoDB')
+        self.assertEqual(self.ac.totals['AllAccounts'].usage['this_month'],
+                         {'SQS': decimal.Decimal('0.48793206'),
+                          'DynamoDB': decimal.Decimal('1.89673919'),
+                          'EC2': decimal.Decimal('0.89900000'),
+                          'SimpleDB': decimal.Decimal('0.00000486'),
+                          'SNS': decimal.Decimal('0E-8')})
+        self.assertNotIn('one_day_ago', account.usage)
+
+    def test_report_requests(self):
+        config = {'accounts': {'111111111111': {'bucket': 'billing'},
+                               '222222222222': {}}}
+        now = pytz.utc.localize(datetime.datetime(2015, 1, 31, 12))
+        self.assertEqual(report_requests(config, now),
+                         [('111111111111', 2015, 1),
+                          ('111111111111', 2014, 12)])
+        now = pytz.utc.localize(datetime.datetime(2015, 3, 31, 12))
+        self.assertEqual(report_requests(config, now),
+                         [('111111111111', 2015, 3),
+                          ('111111111111', 2015, 2)])
@@ -0,0 +1,84 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import csv
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import pytz
+
+from skinflint import export
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.metric import to_decimal
+from skinflint.slice import SuperSlice
+from tests.unit.util import get_billing_filepath
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        now = pytz.utc.localize(datetime.datetime(2015, 3, 2, 12))
+        self.ss = SuperSlice(now)
+        self.ss.load(DetailedBillReportReader(
+            get_billing_filepath('test.csv')))
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_records(self):
+        records = list(export.records(self.ss))
+        self.assertEqual(len(records), sum(
+            len(m._data) for s in self.ss.slices.values() for m in s.metrics))
+        total = sum(r[5] for r in records if r[3] == 'TotalUsage')
+        self.assertEqual(to_decimal(total),
+                         sum(self.ss.all().metrics[0].data.values()))
+        days = list(export.records(self.ss, 'day'))
+        self.assertEqual(sum(r[5] for r in days if r[3] == 'TotalUsage'),
+                         total)
+        windows = list(export.records(self.ss, 'window'))
+        self.assertEqual(
+            set(r[0] for r in windows),
+            set(['latest', 'this_month']))
+
+    def test_csv(self):
+        path = os.path.join(self.tmp_dir, 'export.csv')
+        export.export(self.ss, path, 'csv')
+        fp = open(path)
+        rows = list(csv.DictReader(fp))
+        fp.close()
+        records = list(export.records(self.ss))
+        self.assertEqual(len(rows), len(records))
+        self.assertEqual(rows[0]['dimensions'], 'account|service|type')
+        self.assertEqual(rows[0]['key'], '|'.join(records[0][4]))
+        self.assertEqual(rows[0]['cost'], str(to_decimal(records[0][5])))
+
+    def test_jsonl(self):
+        fp = io.StringIO()
+        export.write_jsonl(export.records(self.ss, 'day'), fp)
+        lines = fp.getvalue().splitlines()
+        record = json.loads(lines[0])
+        self.assertEqual(record['start'], '2015-03-01T00:00:00+00:00')
+        self.assertEqual(record['metric'], 'TotalUsage')
+        self.assertIn('account', record)
+
+    def test_columnar(self):
+        records = list(export.records(self.ss))
+        fp = io.BytesIO()
+        export.write_columnar(iter(records), fp, block_size=3)
+        fp.seek(0)
+        self.assertEqual(list(export.read_columnar(fp)), records)
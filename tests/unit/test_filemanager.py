@@ -0,0 +1,201 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.filemanager import FileManager
+from tests.unit.util import get_billing_filepath
+
+
+class FakeKey(object):
+
+    # Enough of boto.s3.key.Key for FileManager
+
+    def __init__(self, bucket, name, data=None):
+        self.bucket = bucket
+        self.name = name
+        self.data = data
+        if data is None:
+            self.data = bucket.objects[name]
+        self.size = len(self.data)
+        self.etag = '"%x"' % hash(self.data)
+        self.last_modified = 'Sun, 01 Mar 2015 00:00:00 GMT'
+
+    def get_contents_to_file(self, fp, headers=None):
+        data = self.data
+        if headers and 'Range' in headers:
+            start, end = headers['Range'][len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1]
+        with self.bucket.s3.lock:
+            self.bucket.s3.gets.append((self.name, len(data)))
+        fp.write(data)
+
+    def get_contents_to_filename(self, filename):
+        fp = open(filename, 'wb')
+        try:
+            self.get_contents_to_file(fp)
+        finally:
+            fp.close()
+
+
+class FakeBucket(object):
+
+    def __init__(self, s3, name):
+        self.s3 = s3
+        self.name = name
+        self.objects = {}
+
+    def lookup(self, key_name):
+        if key_name not in self.objects:
+            return None
+        return FakeKey(self, key_name)
+
+    def new_key(self, key_name):
+        return FakeKey(self, key_name)
+
+    def list(self, prefix=''):
+        with self.s3.lock:
+            self.s3.listings.append((self.name, prefix))
+        return [FakeKey(self, key_name) for key_name in self.objects
+                if key_name.startswith(prefix)]
+
+
+class FakeS3(object):
+
+    def __init__(self):
+        self.buckets = {}
+        self.lookups = []
+        self.listings = []
+        self.gets = []
+        self.lock = threading.Lock()
+
+    def lookup(self, bucket_name):
+        self.lookups.append(bucket_name)
+        return self.buckets.get(bucket_name)
+
+
+class FakeFileManager(FileManager):
+
+    def __init__(self, config, s3):
+        super(FakeFileManager, self).__init__(config)
+        self.s3 = s3
+        self.connects = []
+
+    def _connect(self, profile):
+        self.connects.append(profile)
+        return self.s3
+
+
+class TestFileManager(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.s3 = FakeS3()
+        bucket = FakeBucket(self.s3, 'billing')
+        self.s3.buckets['billing'] = bucket
+        fp = open(get_billing_filepath('test.csv'), 'rb')
+        self.data = fp.read()
+        fp.close()
+        self.config = {'cache_dir': self.cache_dir,
+                       'compressed_cache': True,
+                       'accounts': {}}
+        self.requests = []
+        for account_id in ['111111111111', '222222222222']:
+            self.config['accounts'][account_id] = {'profile': 'payer',
+                                                   'bucket': 'billing'}
+            for month in [2, 3]:
+                key_name = DetailedBillReportReader.KeyName.format(
+                    id=account_id, year=2015, month=month)
+                bucket.objects[key_name] = self.data
+                self.requests.append(
+                    (DetailedBillReportReader, account_id, 2015, month))
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def read(self, path):
+        fp = open(path, 'rb')
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+
+    def test_fetch_many(self):
+        fm = FakeFileManager(self.config, self.s3)
+        file_names = fm.fetch_many(self.requests)
+        self.assertEqual(len(file_names), 4)
+        for file_name in file_names:
+            self.assertEqual(self.read(file_name), self.data)
+        # one connection and bucket lookup for every account
+        self.assertEqual(fm.connects, ['payer'])
+        self.assertEqual(self.s3.lookups, ['billing'])
+        # and one listing of the reports of every account
+        prefix = ('%s-aws-billing-detailed-line-items-with-resources-'
+                  'and-tags-')
+        self.assertEqual(sorted(self.s3.listings),
+                         [('billing', prefix % '111111111111'),
+                          ('billing', prefix % '222222222222')])
+        self.assertEqual(len(self.s3.gets), 4)
+
+    def test_ranged_download(self):
+        self.config['multipart_threshold'] = 100
+        self.config['multipart_chunk_size'] = 1000
+        fm = FakeFileManager(self.config, self.s3)
+        file_name = fm.fetch_many(self.requests[:1])[0]
+        self.assertEqual(self.read(file_name), self.data)
+        parts = (len(self.data) + 999) // 1000
+        self.assertEqual(len(self.s3.gets), parts)
+        self.assertFalse(os.path.exists(file_name + '.part'))
+
+    def test_manifest(self):
+        fm = FakeFileManager(self.config, self.s3)
+        file_name = fm.fetch_many(self.requests[:1])[0]
+        self.assertEqual(len(self.s3.gets), 1)
+        # a new run finds the cached copy fresh
+        fm = FakeFileManager(self.config, self.s3)
+        fm.fetch_many(self.requests[:1])
+        self.assertEqual(len(self.s3.gets), 1)
+        # reading the file does not matter, changing the key does
+        self.read(file_name)
+        bucket = self.s3.buckets['billing']
+        key_name = os.path.basename(file_name)
+        bucket.objects[key_name] = self.data + b'\n'
+        fm = FakeFileManager(self.config, self.s3)
+        fm.fetch_many(self.requests[:1])
+        self.assertEqual(len(self.s3.gets), 2)
+        self.assertEqual(self.read(file_name), self.data + b'\n')
+        # as does a damaged cached copy
+        fp = open(file_name, 'ab')
+        fp.write(b'x')
+        fp.close()
+        fm = FakeFileManager(self.config, self.s3)
+        fm.fetch_many(self.requests[:1])
+        self.assertEqual(len(self.s3.gets), 3)
+
+    def test_shared_manifest(self):
+        # Two managers sharing a cache keep each other's entries
+        fm1 = FakeFileManager(self.config, self.s3)
+        fm2 = FakeFileManager(self.config, self.s3)
+        fm1.fetch_many(self.requests[:1])
+        fm2.fetch_many(self.requests[1:2])
+        self.assertEqual(len(self.s3.gets), 2)
+        fm = FakeFileManager(self.config, self.s3)
+        fm.fetch_many(self.requests[:2])
+        self.assertEqual(len(self.s3.gets), 2)
+        self.assertEqual(
+            [name for name in os.listdir(self.cache_dir)
+             if name.endswith('.tmp')], [])
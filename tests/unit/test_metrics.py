@@ -11,17 +11,14 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 import unittest
-import os
 import datetime
 import pytz
 import decimal
 
 from skinflint.billreader import DetailedBillReportReader
-from skinflint.slice import slicer
-
-
-def get_billing_filepath(name):
-    return os.path.join(os.path.dirname(__file__), 'data', name)
+from skinflint.metric import to_fixed, to_decimal, TotalUsage
+from skinflint.slice import slicer, SuperSlice
+from tests.unit.util import get_billing_filepath
 
 
 class TestMetrics(unittest.TestCase):
@@ -134,4 +131,176 @@ class TestMetrics(unittest.TestCase):
         self.assertEqual(result['234567890123|SQS|usage'],
                          decimal.Decimal('0.48793206'))
 
-        
+    def test_merge(self):
+        other = slicer(
+            DetailedBillReportReader(get_billing_filepath('test.csv')))
+        self.sc.merge(other)
+        self.assertEqual(len(self.sc.slices), 3)
+        slice = self.sc.slices[self.slice0_key]
+        self.assertEqual(
+            slice.metrics[0].data['012345678901|EC2|usage'],
+            decimal.Decimal('0.26400000'))
+        self.assertEqual(
+            slice.metrics[1].data['234567890123|EC2|m1.small'],
+            decimal.Decimal('0.15000000'))
+
+    def test_window(self):
+        start = pytz.utc.localize(datetime.datetime(2015, 3, 1))
+        end = pytz.utc.localize(datetime.datetime(2015, 3, 2))
+        slices = self.sc.window(start, end)
+        self.assertEqual(len(slices), 3)
+        self.assertIs(slices[0], self.sc.slices[self.slice0_key])
+        self.assertIs(slices[1], self.sc.slices[self.slice1_key])
+        self.assertIs(slices[2], self.sc.slices[self.slice2_key])
+        # slices must be entirely inside the window
+        end = pytz.utc.localize(datetime.datetime(2015, 3, 1, 19, 30))
+        slices = self.sc.window(self.end, end)
+        self.assertEqual(len(slices), 1)
+        self.assertIs(slices[0], self.sc.slices[self.slice1_key])
+        slice = self.sc.aggregate(self.end, end)
+        self.assertEqual(len(slice.metrics[0].data), 1)
+        self.assertEqual(len(slice.metrics[1].data), 0)
+
+
+class TestFixedPoint(unittest.TestCase):
+
+    def test_to_fixed(self):
+        self.assertEqual(to_fixed('0.13200000'), 13200000)
+        self.assertEqual(to_fixed('12'), 1200000000)
+        self.assertEqual(to_fixed('-0.5'), -50000000)
+        self.assertEqual(to_fixed('.25'), 25000000)
+        self.assertEqual(to_fixed('1E-8'), 1)
+        self.assertEqual(to_fixed('0.000000015'), 2)
+        self.assertEqual(to_fixed(decimal.Decimal('1.89673919')), 189673919)
+        self.assertEqual(to_fixed(42), 42)
+        self.assertRaises(decimal.InvalidOperation, to_fixed, 'abc')
+        for value in ('', '.', '-', '-.'):
+            self.assertRaises(decimal.InvalidOperation, to_fixed, value)
+
+    def test_to_decimal(self):
+        self.assertEqual(to_decimal(13200000), decimal.Decimal('0.132'))
+        self.assertEqual(str(to_decimal(13200000)), '0.13200000')
+        self.assertEqual(to_decimal(0), decimal.Decimal('0E-8'))
+
+    def test_metric_costs(self):
+        metric = TotalUsage()
+        lineitem = {'LinkedAccountId': '012345678901',
+                    'ProductName': 'Amazon Elastic Compute Cloud',
+                    'UsageType': 'BoxUsage'}
+        lineitem['BlendedCost'] = decimal.Decimal('0.10000001')
+        metric.add(lineitem)
+        lineitem['BlendedCost'] = '0.2'
+        metric.add(lineitem)
+        lineitem['BlendedCost'] = 1
+        metric.add(lineitem)
+        self.assertEqual(metric.data['012345678901|EC2|usage'],
+                         decimal.Decimal('0.30000002'))
+
+
+class TestMetricKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.metric = TotalUsage()
+        self.keys = {}
+        for account, product, usage_type in [
+                ('111111111111', 'Amazon Elastic Compute Cloud', 'BoxUsage'),
+                ('111111111111', 'Amazon Simple Queue Service', ''),
+                ('222222222222', 'Amazon Elastic Compute Cloud', 'BoxUsage')]:
+            self.metric.add({'LinkedAccountId': account,
+                             'ProductName': product,
+                             'UsageType': usage_type,
+                             'BlendedCost': '1.5'}, self.keys)
+
+    def test_shared_keys(self):
+        lineitem = {'LinkedAccountId': '111111111111',
+                    'ProductName': 'Amazon Elastic Compute Cloud',
+                    'UsageType': 'BoxUsage',
+                    'BlendedCost': '1.5'}
+        other = TotalUsage()
+        other.add(lineitem, self.keys)
+        key = ('111111111111', 'EC2', 'usage')
+        keys1 = [k for k in self.metric._data if k == key]
+        keys2 = [k for k in other._data if k == key]
+        self.assertIs(keys1[0], keys2[0])
+        self.assertEqual(len(self.keys), 3)
+        # without keys nothing is kept outside of the metric
+        other = TotalUsage()
+        other.add(lineitem)
+        self.assertIsNot(list(other._data)[0], keys1[0])
+        self.assertEqual(len(self.keys), 3)
+
+    def test_load_shares_keys(self):
+        ss = SuperSlice()
+        ss.load(DetailedBillReportReader(get_billing_filepath('test.csv')))
+        keys = {}
+        for new_slice in ss.slices.values():
+            for key in new_slice.metrics[0]._data:
+                self.assertIs(keys.setdefault(key, key), key)
+
+    def test_indexed_query(self):
+        result = self.metric.query(account='111111111111')
+        self.assertEqual(sorted(result), ['111111111111|EC2|usage',
+                                          '111111111111|SQS|one-time'])
+        result = self.metric.query(service='EC2', type='usage')
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result['222222222222|EC2|usage'],
+                         decimal.Decimal('1.5'))
+        self.assertEqual(self.metric.query(account='333333333333'), {})
+        self.assertEqual(len(self.metric.query(foo='bar')), 3)
+        # the index is kept up to date once it exists
+        self.metric.add({'LinkedAccountId': '333333333333',
+                         'ProductName': 'Amazon Elastic Compute Cloud',
+                         'UsageType': 'BoxUsage',
+                         'BlendedCost': '2'})
+        result = self.metric.query(account='333333333333')
+        self.assertEqual(result, {'333333333333|EC2|usage':
+                                  decimal.Decimal('2')})
+        other = TotalUsage()
+        other.add({'LinkedAccountId': '444444444444',
+                   'ProductName': 'Amazon Simple Queue Service',
+                   'UsageType': '',
+                   'BlendedCost': '2'})
+        self.metric + other
+        self.assertEqual(len(self.metric.query(type='one-time')), 2)
+
+    def test_pattern_query(self):
+        result = self.metric.query(account='1+', service='E.2')
+        self.assertEqual(list(result), ['111111111111|EC2|usage'])
+
+    def test_dimensions(self):
+        dimensions = self.metric.dimensions()
+        self.assertEqual(sorted(dimensions['account']),
+                         ['111111111111', '222222222222'])
+        self.assertEqual(sorted(dimensions['service']), ['EC2', 'SQS'])
+        self.assertEqual(sorted(dimensions['type']), ['one-time', 'usage'])
+
+    def test_group_by(self):
+        self.assertEqual(self.metric.group_by('account'),
+                         {'111111111111': decimal.Decimal('3'),
+                          '222222222222': decimal.Decimal('1.5')})
+        self.assertEqual(self.metric.group_by('service', 'type'),
+                         {('EC2', 'usage'): decimal.Decimal('3'),
+                          ('SQS', 'one-time'): decimal.Decimal('1.5')})
+        self.assertEqual(self.metric.group_by(),
+                         {(): decimal.Decimal('4.5')})
+        self.assertRaises(ValueError, self.metric.group_by, 'foo')
+
+    def test_metric_data(self):
+        metric = TotalUsage()
+        lineitem = {'LinkedAccountId': '012345678901',
+                    'ProductName': 'Amazon Elastic Compute Cloud',
+                    'UsageType': 'BoxUsage',
+                    'BlendedCost': '0.5'}
+        metric.add(lineitem)
+        data = metric.data
+        self.assertIs(metric.data, data)
+        self.assertEqual(metric.to_decimal_dict(), data)
+        self.assertEqual(list(metric.items()),
+                         [(('012345678901', 'EC2', 'usage'), 50000000)])
+        self.assertRaises(TypeError, data.__setitem__, 'x', 1)
+        self.assertRaises(TypeError, data.update, {'x': 1})
+        # adding a cost gives new data
+        metric.add(lineitem)
+        self.assertIsNot(metric.data, data)
+        self.assertEqual(metric.data['012345678901|EC2|usage'],
+                         decimal.Decimal('1'))
@@ -0,0 +1,91 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import os
+import shutil
+import tempfile
+
+from skinflint import stats
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.parallel import split_report, load_report
+from skinflint.slice import SuperSlice
+from tests.unit.util import SuperSliceAssertions, get_billing_filepath
+
+
+class TestParallel(SuperSliceAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmpdir, 'test.csv')
+        fp = open(get_billing_filepath('test.csv'))
+        lines = fp.readlines()
+        fp.close()
+        # Give some rows a description with newlines in it and some a
+        # RateId of 0 so they belong to the slice of the row before.
+        for i in range(2, len(lines), 3):
+            lines[i] = lines[i].replace(
+                '","N","', '","N","multi\nline\n""quoted"" ')
+        for i in range(4, len(lines), 5):
+            fields = lines[i].split('","')
+            fields[6] = '0'
+            fields[14] = '2015-03-05 00:00:00'
+            lines[i] = '","'.join(fields)
+        fp = open(self.file_path, 'w')
+        fp.writelines(lines)
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_split_report(self):
+        size = os.path.getsize(self.file_path)
+        fp = open(self.file_path, 'rb')
+        data = fp.read()
+        fp.close()
+        for parts in range(1, 30):
+            ranges = split_report(self.file_path, parts)
+            self.assertTrue(len(ranges) <= parts)
+            self.assertEqual(ranges[-1][1], size)
+            for i in range(1, len(ranges)):
+                self.assertEqual(ranges[i - 1][1], ranges[i][0])
+            rows = 0
+            for start, end in ranges:
+                self.assertEqual(data[start - 1:start], b'\n')
+                self.assertEqual(data[:start].count(b'"') % 2, 0)
+                lineitems = list(DetailedBillReportReader(
+                    self.file_path, offset=start, end=end))
+                self.assertNotEqual(lineitems[0]['RateId'], '0')
+                rows += len(lineitems)
+            self.assertEqual(rows, 23)
+
+    def test_load_report(self):
+        serial = SuperSlice()
+        serial.load(DetailedBillReportReader(self.file_path))
+        self.assertEqual(len(serial.slices), 3)
+        ss = load_report(self.file_path, 4)
+        self.assertSuperSlicesEqual(ss, serial)
+
+    def test_worker_stats(self):
+        # The counters of the workers are merged into those of the
+        # parent and the rows of the ranges add up to those of the report
+        stats.reset()
+        stats.enable()
+        try:
+            load_report(self.file_path, 4)
+            counters = stats.snapshot()['counters']
+        finally:
+            stats.disable()
+            stats.reset()
+        self.assertEqual(counters['reader.reports'], 4)
+        self.assertEqual(counters['reader.rows'], 23)
+        self.assertEqual(counters['superslice.rows'], 23)
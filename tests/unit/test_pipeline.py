@@ -0,0 +1,164 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import datetime
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+import pytz
+
+from skinflint import pipeline
+from skinflint import stats
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.slice import Slice, SuperSlice
+from tests.unit.test_filemanager import FakeBucket, FakeFileManager, FakeS3
+from tests.unit.util import SuperSliceAssertions, get_billing_filepath
+
+
+class TestPipeline(SuperSliceAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.now = pytz.utc.localize(datetime.datetime(2015, 3, 2, 12))
+        self.cache_dir = tempfile.mkdtemp()
+        self.s3 = FakeS3()
+        self.s3.buckets['billing'] = FakeBucket(self.s3, 'billing')
+        self.config = {'cache_dir': self.cache_dir, 'accounts': {}}
+        self.requests = []
+        self.key_names = []
+        for account_id in ['111111111111', '222222222222']:
+            self.config['accounts'][account_id] = {'profile': 'payer',
+                                                   'bucket': 'billing'}
+            for month in [2, 3]:
+                self.add_report(account_id, 2015, month)
+
+    def add_report(self, account_id, year, month):
+        key_name = DetailedBillReportReader.KeyName.format(
+            id=account_id, year=year, month=month)
+        data = io.BytesIO()
+        zf = zipfile.ZipFile(data, 'w')
+        zf.write(get_billing_filepath('test.csv'), key_name[:-4])
+        zf.close()
+        self.s3.buckets['billing'].objects[key_name] = data.getvalue()
+        self.requests.append((account_id, year, month))
+        self.key_names.append(key_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def expected(self):
+        ss = SuperSlice(self.now)
+        for i in range(0, len(self.requests)):
+            partial = SuperSlice(self.now)
+            partial.load(DetailedBillReportReader(
+                get_billing_filepath('test.csv')))
+            ss.merge(partial)
+        return ss
+
+    def test_serial(self):
+        fm = FakeFileManager(self.config, self.s3)
+        ss = pipeline.load_reports(fm, self.requests, self.now, 1, 1)
+        self.assertSuperSlicesEqual(ss, self.expected())
+        self.assertEqual(len(self.s3.gets), 4)
+
+    def test_pool(self):
+        fm = FakeFileManager(self.config, self.s3)
+        ss = pipeline.load_reports(fm, self.requests, self.now, 2)
+        self.assertSuperSlicesEqual(ss, self.expected())
+
+    def test_pool_stats(self):
+        fm = FakeFileManager(self.config, self.s3)
+        stats.reset()
+        stats.enable()
+        try:
+            pipeline.load_reports(fm, self.requests, self.now, 2)
+            counters = stats.snapshot()['counters']
+        finally:
+            stats.disable()
+            stats.reset()
+        self.assertEqual(counters['snapshot.misses'], len(self.requests))
+        self.assertEqual(counters['superslice.rows'], 23 * len(self.requests))
+
+    def test_download_error(self):
+        fm = FakeFileManager(self.config, self.s3)
+        self.assertRaises(ValueError, pipeline.load_reports, fm,
+                          self.requests + [('111111111111', 2014, 12)],
+                          self.now, 1)
+
+    def test_download_error_stops_downloads(self):
+        fm = FakeFileManager(self.config, self.s3)
+        threads = threading.active_count()
+        self.assertRaises(ValueError, pipeline.load_reports, fm,
+                          [('111111111111', 2014, 12)] + self.requests,
+                          self.now, 1, 1)
+        self.assertEqual(threading.active_count(), threads)
+
+    def load_names(self, fm, workers, queue_size):
+        # Loads the requests, returning the file name of every report in
+        # the order they were merged in
+        names = {}
+
+        def parse(args):
+            ss = SuperSlice(self.now)
+            new_slice = Slice(None, None)
+            names[id(new_slice)] = args[0]
+            ss.add(new_slice)
+            return ss
+
+        parse_report = pipeline._parse
+        pipeline._parse = parse
+        try:
+            ss = pipeline.load_reports(
+                fm, self.requests, self.now, workers, queue_size)
+        finally:
+            pipeline._parse = parse_report
+        return [names[id(s)] for s in ss.non_lineitems]
+
+    def test_request_order(self):
+        fm = FakeFileManager(self.config, self.s3)
+        get_bill_file = fm._get_bill_file
+
+        def slow_first(billreader_cls, account_id, year, month):
+            # the first report finishes downloading last
+            if (account_id, year, month) == self.requests[0]:
+                time.sleep(0.2)
+            return get_bill_file(billreader_cls, account_id, year, month)
+
+        fm._get_bill_file = slow_first
+        self.assertEqual(self.load_names(fm, 1, 4),
+                         [os.path.join(self.cache_dir, key_name[:-4])
+                          for key_name in self.key_names])
+
+    def test_slow_report_holds_back_downloads(self):
+        for month in range(4, 10):
+            self.add_report('111111111111', 2015, month)
+        self.config['download_workers'] = 2
+        fm = FakeFileManager(self.config, self.s3)
+        get_bill_file = fm._get_bill_file
+        started = []
+
+        def slow_first(billreader_cls, account_id, year, month):
+            started.append((account_id, year, month))
+            if (account_id, year, month) == self.requests[0]:
+                time.sleep(0.2)
+                # 2 threads + a queue of 1 + 1 worker
+                self.assertLessEqual(len(started), 4)
+            return get_bill_file(billreader_cls, account_id, year, month)
+
+        fm._get_bill_file = slow_first
+        self.assertEqual(len(self.load_names(fm, 1, 1)), 10)
+        self.assertEqual(len(started), 10)
@@ -0,0 +1,113 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+
+import yaml
+
+from skinflint.dailyreport import DailyReport, Header1, Header2
+
+
+def get_sample_config():
+    path = os.path.join(os.path.dirname(__file__), '..', '..',
+                        'skinflint_sample.yml')
+    fp = open(path)
+    try:
+        return yaml.safe_load(fp)
+    finally:
+        fp.close()
+
+
+class TestDailyReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, constant_memory):
+        config = get_sample_config()
+        config['name'] = os.path.join(self.tmp_dir, 'Report')
+        config['constant_memory'] = constant_memory
+        report = DailyReport(config)
+        report.create_page('Summary')
+        report.create_headers('Summary', Header1, 1, 2)
+        report.create_headers('Summary', Header2, 2, 2)
+        report.write_service_data('Summary', 3, 2, 'EC2', [10, 8, 0, 5])
+        report.write_service_data('Summary', 4, 2, 'S3', [5, 4, 3, 0])
+        report.write_service_data('Summary', 5, 2, 'SQS', [1, 2, 3, 4])
+        # written after the rows below it
+        page = report.get_page('Summary')
+        page.write(1, 14, 'Month So Far')
+        report.close()
+        zf = zipfile.ZipFile(config['name'] + '.xlsx')
+        try:
+            return zf.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        finally:
+            zf.close()
+
+    def test_constant_memory(self):
+        sheet = self.write(True)
+        cells = re.findall(r'<c r="([A-Z]+\d+)"', sheet)
+        self.assertEqual(cells, re.findall(r'<c r="([A-Z]+\d+)"',
+                                           self.write(False)))
+        self.assertIn('O2', cells)
+        rows = [int(r) for r in re.findall(r'<row r="(\d+)"', sheet)]
+        self.assertEqual(rows, [2, 3, 4, 5, 6])
+        self.assertIn('Month So Far', sheet)
+
+    def test_conditional_formats(self):
+        sheet = self.write(False)
+        ranges = re.findall(r'<conditionalFormatting sqref="([^"]+)"', sheet)
+        # one range per run of formula cells in a column
+        self.assertEqual(sorted(ranges),
+                         ['F4:F6', 'G4:G6', 'I5:I6', 'J5:J6',
+                          'L4', 'L6', 'M4', 'M6'])
+        self.assertEqual(sheet.count('<cfRule'), 4 * len(ranges))
+
+    def test_write_finished_page(self):
+        config = get_sample_config()
+        config['name'] = os.path.join(self.tmp_dir, 'Report')
+        config['constant_memory'] = True
+        report = DailyReport(config)
+        page = report.create_page('A')
+        page.write(1, 1, 'kept')
+        report.create_page('B')
+        self.assertTrue(page.finished)
+        self.assertRaises(ValueError, page.write, 2, 1, 'lost')
+        self.assertRaises(ValueError, page.merge_range, 2, 1, 2, 3, 'lost')
+        self.assertRaises(ValueError, report.write_service_data,
+                          'A', 3, 2, 'EC2', [10, 8, 0, 5])
+        report.close()
+
+    def test_write_finished_page_in_memory(self):
+        config = get_sample_config()
+        config['name'] = os.path.join(self.tmp_dir, 'Report')
+        report = DailyReport(config)
+        report.create_page('A')
+        report.create_page('B')
+        # Without constant memory the page is still written to directly
+        report.write_service_data('A', 3, 2, 'EC2', [10, 8, 0, 5])
+        report.close()
+        zf = zipfile.ZipFile(config['name'] + '.xlsx')
+        try:
+            sheet = zf.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        finally:
+            zf.close()
+        self.assertIn('<c r="F4"', sheet)
+        self.assertEqual(sheet.count('<conditionalFormatting'), 4)
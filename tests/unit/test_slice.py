@@ -0,0 +1,321 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import datetime
+import decimal
+import pickle
+import random
+
+import pytz
+
+from skinflint import metric
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.slice import Slice, SuperSlice
+from skinflint.slice import parse_report_timestamp, parse_to_aware_datetime
+from tests.unit.util import SuperSliceAssertions, get_billing_filepath
+
+
+def make_lineitem(account, product, usage_type, cost):
+    return {'LinkedAccountId': account,
+            'ProductName': product,
+            'UsageType': usage_type,
+            'BlendedCost': decimal.Decimal(cost)}
+
+
+def make_slices(seed=42, hours=24 * 40):
+    rnd = random.Random(seed)
+    slices = []
+    base = pytz.utc.localize(datetime.datetime(2015, 1, 28))
+    for hour in range(0, hours):
+        start = base + datetime.timedelta(hours=hour)
+        new_slice = Slice(start, start + datetime.timedelta(hours=1))
+        for _ in range(0, rnd.randint(0, 3)):
+            new_slice.add_lineitem(make_lineitem(
+                rnd.choice(['111111111111', '222222222222']),
+                rnd.choice(['Amazon Elastic Compute Cloud',
+                            'Amazon Simple Storage Service']),
+                rnd.choice(['BoxUsage:m3.large', 'TimedStorage-ByteHrs',
+                            'DataTransfer-Out-Bytes', '']),
+                '%d.%08d' % (rnd.randint(0, 9), rnd.randint(0, 10 ** 8))))
+        slices.append(new_slice)
+    # A charge that covers several days and one with no duration
+    spanning = Slice(base + datetime.timedelta(days=3),
+                     base + datetime.timedelta(days=5))
+    spanning.add_lineitem(make_lineitem(
+        '111111111111', 'AWS Support (Business)', '', '100.0'))
+    slices.append(spanning)
+    point = Slice(base + datetime.timedelta(days=4),
+                  base + datetime.timedelta(days=4))
+    point.add_lineitem(make_lineitem(
+        '222222222222', 'Amazon Route 53', '', '0.5'))
+    slices.append(point)
+    return slices
+
+
+def make_superslice(seed=42):
+    ss = SuperSlice()
+    for new_slice in make_slices(seed):
+        ss.add(new_slice)
+    return ss
+
+
+def brute_force(ss, start, end):
+    aggregate_slice = Slice(start, end)
+    for new_slice in ss.slices.values():
+        if new_slice.start >= start and new_slice.end <= end:
+            aggregate_slice + new_slice
+    return aggregate_slice
+
+
+class TestSuperSlice(unittest.TestCase):
+
+    def setUp(self):
+        self.ss = make_superslice()
+
+    def assertSlicesEqual(self, slice1, slice2):
+        for metric1, metric2 in zip(slice1.metrics, slice2.metrics):
+            self.assertEqual(metric1.data, metric2.data)
+
+    def test_rollups(self):
+        self.assertEqual(len(self.ss._days), 40)
+        self.assertEqual(sorted(self.ss._months),
+                         [(2015, 1), (2015, 2), (2015, 3)])
+        self.assertEqual(len(self.ss._spanning), 1)
+
+    def test_timeline(self):
+        hours = self.ss.timeline()
+        self.assertEqual(len(hours), len(self.ss.slices))
+        self.assertEqual([(s.start, s.end) for s in hours],
+                         sorted((s.start, s.end)
+                                for s in self.ss.slices.values()))
+        days = self.ss.timeline('day')
+        # every day plus the slice crossing midnight
+        self.assertEqual(len(days), 41)
+        self.assertEqual(days, sorted(days, key=lambda s: s.start))
+        total = Slice(None, None)
+        for piece in days:
+            total + piece
+        self.assertSlicesEqual(
+            total, brute_force(self.ss, self.ss.start, self.ss.end))
+        self.assertRaises(ValueError, self.ss.timeline, 'week')
+
+    def test_aggregate_matches_brute_force(self):
+        rnd = random.Random(7)
+        base = self.ss.start
+        for _ in range(0, 200):
+            start = base + datetime.timedelta(
+                hours=rnd.randint(-5, 24 * 40), minutes=rnd.choice([0, 30]))
+            end = start + datetime.timedelta(
+                hours=rnd.randint(0, 24 * 35), seconds=rnd.choice([0, -1]))
+            self.assertSlicesEqual(self.ss.aggregate(start, end),
+                                   brute_force(self.ss, start, end))
+
+    def test_month(self):
+        self.assertSlicesEqual(
+            self.ss.month(2015, 2),
+            brute_force(self.ss,
+                        pytz.utc.localize(datetime.datetime(2015, 2, 1)),
+                        pytz.utc.localize(datetime.datetime(2015, 3, 1))))
+        self.assertSlicesEqual(self.ss.all(),
+                               brute_force(self.ss, self.ss.start,
+                                           self.ss.end))
+
+    def test_aggregate_many(self):
+        rnd = random.Random(5)
+        base = self.ss.start
+        windows = {}
+        for i in range(0, 20):
+            start = base + datetime.timedelta(hours=rnd.randint(-5, 24 * 40))
+            end = start + datetime.timedelta(hours=rnd.randint(0, 24 * 35))
+            windows[i] = (start, end)
+        windows['again'] = windows[0]
+        aggregates = self.ss.aggregate_many(windows)
+        self.assertEqual(sorted(aggregates, key=str),
+                         sorted(windows, key=str))
+        for name, (start, end) in windows.items():
+            self.assertSlicesEqual(aggregates[name],
+                                   self.ss.aggregate(start, end))
+
+    def test_report_windows(self):
+        self.ss.now = self.ss.start + datetime.timedelta(days=36, hours=5)
+        aggregates = self.ss.aggregate_many(self.ss.report_windows())
+        for name in ['latest', 'one_day_ago', 'one_week_ago',
+                     'one_month_ago', 'this_month', 'last_month',
+                     'last_month_to_date']:
+            self.assertSlicesEqual(aggregates[name],
+                                   getattr(self.ss, name)())
+
+
+class TestSources(SuperSliceAssertions, unittest.TestCase):
+
+    def assertSuperSlicesEqual(self, ss1, ss2):
+        # and so are their aggregates
+        super(TestSources, self).assertSuperSlicesEqual(ss1, ss2)
+        rnd = random.Random(3)
+        for _ in range(0, 50):
+            start = ss2.start + datetime.timedelta(
+                hours=rnd.randint(-5, 24 * 40))
+            end = start + datetime.timedelta(hours=rnd.randint(0, 24 * 35))
+            for metric1, metric2 in zip(ss1.aggregate(start, end).metrics,
+                                        ss2.aggregate(start, end).metrics):
+                self.assertEqual(metric1.data, metric2.data)
+            for metric1, metric2 in zip(ss1.aggregate(start, end).metrics,
+                                        brute_force(ss1, start, end).metrics):
+                self.assertEqual(metric1.data, metric2.data)
+
+    def build(self, sources):
+        ss = SuperSlice()
+        for source, seed in sources:
+            for new_slice in make_slices(seed):
+                ss.add(new_slice, source)
+        return ss
+
+    def test_load_is_idempotent(self):
+        once = SuperSlice()
+        once.load(DetailedBillReportReader(get_billing_filepath('test.csv')))
+        twice = SuperSlice()
+        twice.load(DetailedBillReportReader(get_billing_filepath('test.csv')))
+        twice.load(DetailedBillReportReader(get_billing_filepath('test.csv')))
+        self.assertSuperSlicesEqual(twice, once)
+
+    def test_load_with_source(self):
+        ss = SuperSlice()
+        dbr = DetailedBillReportReader(get_billing_filepath('test.csv'))
+        ss.load(dbr, source='a')
+        dbr = DetailedBillReportReader(get_billing_filepath('test.csv'))
+        ss.load(dbr, source='b')
+        key = '2015-03-01 00:00:00+00:00-2015-03-01 01:00:00+00:00'
+        self.assertEqual(
+            ss.slices[key].metrics[0].data['012345678901|EC2|usage'],
+            decimal.Decimal('0.26400000'))
+        ss.remove('b')
+        self.assertEqual(
+            ss.slices[key].metrics[0].data['012345678901|EC2|usage'],
+            decimal.Decimal('0.13200000'))
+
+    def test_replace_source(self):
+        ss = self.build([('a', 1), ('b', 2), (None, 3)])
+        other = SuperSlice()
+        for new_slice in make_slices(4, hours=24 * 10):
+            other.add(new_slice)
+        ss.merge(other, source='b')
+        expected = self.build([('a', 1), (None, 3)])
+        for new_slice in make_slices(4, hours=24 * 10):
+            expected.add(new_slice, 'b')
+        self.assertSuperSlicesEqual(ss, expected)
+
+    def test_remove_source(self):
+        ss = self.build([('a', 1), ('b', 2)])
+        ss.remove('a')
+        self.assertSuperSlicesEqual(ss, self.build([('b', 2)]))
+        ss.remove('b')
+        self.assertEqual(ss.slices, {})
+        self.assertEqual(ss._days, {})
+        self.assertEqual(ss._months, {})
+        self.assertIsNone(ss.start)
+        ss.remove('c')
+
+
+class TestLoad(unittest.TestCase):
+
+    def load(self, lineitems):
+        ss = SuperSlice()
+        ss.load(iter(lineitems))
+        return ss
+
+    def test_unsorted_rows(self):
+        dbr = DetailedBillReportReader(get_billing_filepath('test.csv'))
+        lineitems = [lineitem.as_dict() for lineitem in dbr]
+        ss = self.load(lineitems)
+        rnd = random.Random(11)
+        for _ in range(0, 5):
+            rnd.shuffle(lineitems)
+            shuffled = self.load(lineitems)
+            self.assertEqual(sorted(shuffled.slices), sorted(ss.slices))
+            for key in ss.slices:
+                # one Slice per usage period, however the rows are ordered
+                self.assertEqual(len(shuffled._contributions[key]), 1)
+                for metric1, metric2 in zip(shuffled.slices[key].metrics,
+                                            ss.slices[key].metrics):
+                    self.assertEqual(metric1.data, metric2.data)
+
+
+class TestSliceLayout(unittest.TestCase):
+
+    def make_slice(self):
+        return Slice('2015-03-01 00:00:00', '2015-03-01 01:00:00')
+
+    def test_no_dict(self):
+        new_slice = self.make_slice()
+        self.assertFalse(hasattr(new_slice, '__dict__'))
+        for m in new_slice.metrics:
+            self.assertFalse(hasattr(m, '__dict__'))
+
+    def test_shared_empty_data(self):
+        new_slice = self.make_slice()
+        new_slice.add_lineitem(make_lineitem(
+            '111111111111', 'Amazon Elastic Compute Cloud',
+            'BoxUsage:m3.large', '1.5'))
+        other = self.make_slice()
+        other + new_slice
+        self.assertEqual(metric._NoData, {})
+        self.assertIsNot(other.metrics[0]._data, metric._NoData)
+        self.assertIs(other.metrics[2]._data, metric._NoData)
+
+    def test_pickle(self):
+        empty = self.make_slice()
+        full = self.make_slice()
+        full.add_lineitem(make_lineitem(
+            '111111111111', 'Amazon Elastic Compute Cloud',
+            'BoxUsage:m3.large', '1.5'))
+        full.metrics[0].query(account='111111111111')
+        for new_slice in [empty, full]:
+            copy = pickle.loads(pickle.dumps(new_slice, 2))
+            self.assertEqual(copy.start, new_slice.start)
+            self.assertEqual(copy.end, new_slice.end)
+            total = self.make_slice()
+            total + copy
+            total + new_slice
+            for m, copied in zip(new_slice.metrics, copy.metrics):
+                self.assertEqual(copied.data, m.data)
+                self.assertIsNone(copied._index)
+            for m, summed in zip(new_slice.metrics, total.metrics):
+                self.assertEqual(summed.data,
+                                 dict((k, v * 2) for k, v in m.data.items()))
+        self.assertEqual(metric._NoData, {})
+
+
+class TestTimestamps(unittest.TestCase):
+
+    def test_report_format(self):
+        for value in ['2015-03-01 00:00:00', '2016-02-29 23:59:59']:
+            timestamp = parse_report_timestamp(value)
+            self.assertEqual(timestamp, parse_to_aware_datetime(value))
+            self.assertEqual(str(timestamp),
+                             str(parse_to_aware_datetime(value)))
+            self.assertIs(parse_report_timestamp(value), timestamp)
+
+    def test_other_formats(self):
+        for value in ['2015-03-01T00:00:00Z', '2015-03-01 00:00:00-0700',
+                      '1425168000']:
+            self.assertEqual(parse_report_timestamp(value),
+                             parse_to_aware_datetime(value))
+        self.assertRaises(ValueError, parse_report_timestamp,
+                          '2015-02-30 00:00:00')
+        timestamp = pytz.utc.localize(datetime.datetime(2015, 3, 1))
+        self.assertEqual(parse_report_timestamp(timestamp), timestamp)
+
+    def test_slices_share_timestamps(self):
+        slice1 = Slice('2015-03-01 00:00:00', '2015-03-01 01:00:00')
+        slice2 = Slice('2015-03-01 01:00:00', '2015-03-01 02:00:00')
+        self.assertIs(slice1.end, slice2.start)
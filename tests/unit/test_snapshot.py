@@ -0,0 +1,160 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import os
+import shutil
+import tempfile
+
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.slice import SuperSlice
+from skinflint import parallel
+from skinflint import snapshot
+from tests.unit.util import SuperSliceAssertions, get_billing_filepath
+
+
+class TestSnapshot(SuperSliceAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmpdir, 'test.csv')
+        shutil.copy(get_billing_filepath('test.csv'), self.file_path)
+        self.ss = SuperSlice()
+        self.ss.load(DetailedBillReportReader(self.file_path))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        fingerprint = snapshot.fingerprint(self.file_path, '"abc"')
+        self.assertIsNone(snapshot.load(self.file_path, fingerprint))
+        snapshot.save(self.ss, self.file_path, fingerprint)
+        ss = snapshot.load(self.file_path, fingerprint, self.ss.now)
+        self.assertSuperSlicesEqual(ss, self.ss)
+        for metric, other in zip(ss.all().metrics, self.ss.all().metrics):
+            self.assertEqual(metric.data, other.data)
+
+    def test_stale_snapshot(self):
+        fingerprint = snapshot.fingerprint(self.file_path, '"abc"')
+        snapshot.save(self.ss, self.file_path, fingerprint)
+        other = snapshot.fingerprint(self.file_path, '"def"')
+        self.assertIsNone(snapshot.load(self.file_path, other))
+        fp = open(self.file_path, 'a')
+        fp.write('\n')
+        fp.close()
+        other = snapshot.fingerprint(self.file_path, '"abc"')
+        self.assertIsNone(snapshot.load(self.file_path, other))
+
+    def test_unreadable_snapshot(self):
+        fp = open(snapshot.snapshot_path(self.file_path), 'wb')
+        fp.write(b'garbage')
+        fp.close()
+        fingerprint = snapshot.fingerprint(self.file_path)
+        self.assertIsNone(snapshot.load(self.file_path, fingerprint))
+
+    def test_truncated_snapshot(self):
+        fingerprint = snapshot.fingerprint(self.file_path, '"abc"')
+        snapshot.save(self.ss, self.file_path, fingerprint)
+        path = snapshot.snapshot_path(self.file_path)
+        fp = open(path, 'r+b')
+        fp.truncate(os.path.getsize(path) - 10)
+        fp.close()
+        self.assertIsNone(snapshot.load(self.file_path, fingerprint))
+        # and a refresh parses the report again
+        ss = snapshot.refresh(self.file_path, fingerprint)
+        self.assertEqual(sorted(ss.slices), sorted(self.ss.slices))
+        self.assertIsNotNone(snapshot.load(self.file_path, fingerprint))
+
+
+class TestIncrementalRefresh(SuperSliceAssertions, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tmpdir, 'test.csv')
+        fp = open(get_billing_filepath('test.csv'))
+        self.lines = fp.readlines()
+        fp.close()
+        # The first 8 rows cover the 00:00 and 01:00 hours, the rest of
+        # the report adds the 19:00 hour.
+        self.write_lines(self.lines[:9])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_lines(self, lines):
+        fp = open(self.file_path, 'w')
+        fp.writelines(lines)
+        fp.close()
+
+    def refresh(self):
+        fingerprint = snapshot.fingerprint(self.file_path)
+        return snapshot.refresh(self.file_path, fingerprint)
+
+    def full_parse(self):
+        ss = SuperSlice()
+        ss.load(DetailedBillReportReader(self.file_path))
+        return ss
+
+    def test_appended_rows(self):
+        ss = self.refresh()
+        self.assertEqual(len(ss.slices), 2)
+        self.write_lines(self.lines)
+        ss = self.refresh()
+        self.assertSuperSlicesEqual(ss, self.full_parse())
+
+    def test_only_tail_is_parsed(self):
+        self.refresh()
+        # Replace the snapshot contents, keeping its offset and digest,
+        # so anything parsed from the start of the report would show.
+        header, _ = snapshot._read(self.file_path)
+        snapshot.save(SuperSlice(), self.file_path, header['fingerprint'],
+                      header['offset'], header['digest'])
+        self.write_lines(self.lines + self.lines[1:2])
+        ss = self.refresh()
+        self.assertEqual(len(ss.slices), 3)
+        self.write_lines(self.lines[:1] + self.lines[9:] + self.lines[1:2])
+        tail = self.full_parse()
+        self.write_lines(self.lines + self.lines[1:2])
+        self.assertSuperSlicesEqual(ss, tail)
+
+    def test_restated_rows(self):
+        self.refresh()
+        self.write_lines(self.lines[:1] + self.lines[2:])
+        ss = self.refresh()
+        self.assertSuperSlicesEqual(ss, self.full_parse())
+        self.write_lines(self.lines)
+        ss = self.refresh()
+        self.assertSuperSlicesEqual(ss, self.full_parse())
+
+    def test_reports_are_closed(self):
+        readers = []
+
+        class Reader(DetailedBillReportReader):
+
+            def __init__(self, *args, **kwargs):
+                super(Reader, self).__init__(*args, **kwargs)
+                readers.append(self)
+
+        modules = (parallel, snapshot)
+        for module in modules:
+            module.DetailedBillReportReader = Reader
+        try:
+            self.refresh()
+            self.write_lines(self.lines)
+            self.refresh()
+        finally:
+            for module in modules:
+                module.DetailedBillReportReader = DetailedBillReportReader
+        # a full parse and then just the tail
+        self.assertEqual(len(readers), 2)
+        for reader in readers:
+            self.assertTrue(reader._fp.closed)
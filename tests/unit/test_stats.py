@@ -0,0 +1,109 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import unittest
+import io
+import json
+
+from skinflint import stats
+from skinflint.billreader import DetailedBillReportReader
+from skinflint.slice import SuperSlice
+from tests.unit.util import get_billing_filepath
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        stats.reset()
+
+    def tearDown(self):
+        stats.disable()
+        stats.reset()
+
+    def load(self):
+        ss = SuperSlice()
+        ss.load(DetailedBillReportReader(get_billing_filepath('test.csv')))
+        return ss
+
+    def test_disabled(self):
+        self.load()
+        self.assertEqual(stats.snapshot(), {'counters': {}, 'timings': {}})
+
+    def test_load(self):
+        stats.enable()
+        ss = self.load()
+        ss.aggregate(ss.start, ss.end)
+        snapshot = stats.snapshot()
+        counters = snapshot['counters']
+        self.assertEqual(counters['reader.reports'], 1)
+        self.assertEqual(counters['reader.rows'], 23)
+        self.assertEqual(counters['superslice.rows'], 23)
+        self.assertEqual(counters['superslice.slices'],
+                         len(ss.slices) + len(ss.non_lineitems))
+        self.assertEqual(counters['metric.TotalUsage.keys'], 9)
+        for name in ['superslice.load.rows', 'superslice.load.add',
+                     'superslice.aggregate']:
+            self.assertEqual(snapshot['timings'][name]['count'], 1)
+        fp = io.StringIO()
+        stats.dump(fp)
+        self.assertEqual(json.loads(fp.getvalue()), snapshot)
+
+    def test_collect(self):
+        events = []
+
+        def hook(kind, name, value):
+            events.append((kind, name, value))
+
+        def work(value):
+            stats.incr('counted', value)
+            with stats.timer('timed'):
+                pass
+            return value
+
+        stats.enable()
+        stats.incr('counted')
+        stats.add_hook(hook)
+        try:
+            result, collected = stats.collect(work, (2,))
+            self.assertEqual(result, 2)
+            self.assertEqual(collected['counters'], {'counted': 2})
+            self.assertEqual(collected['timings']['timed']['count'], 1)
+            # nothing is recorded here until the stats are merged
+            self.assertEqual(events, [])
+            self.assertEqual(stats.snapshot()['counters'], {'counted': 1})
+            stats.merge(collected)
+            stats.merge(None)
+        finally:
+            stats.remove_hook(hook)
+        self.assertEqual(stats.snapshot()['counters'], {'counted': 3})
+        self.assertEqual(stats.snapshot()['timings']['timed']['count'], 1)
+        self.assertEqual([e[:2] for e in events],
+                         [('counter', 'counted'), ('timing', 'timed')])
+        self.assertEqual(stats.collect(work, (2,), False), (2, None))
+
+    def test_hooks(self):
+        events = []
+
+        def hook(kind, name, value):
+            events.append((kind, name))
+
+        stats.add_hook(hook)
+        try:
+            stats.incr('ignored')
+            stats.enable()
+            stats.incr('counted', 2)
+            with stats.timer('timed'):
+                pass
+        finally:
+            stats.remove_hook(hook)
+        self.assertEqual(events, [('counter', 'counted'), ('timing', 'timed')])
+        self.assertEqual(stats.snapshot()['counters'], {'counted': 2})
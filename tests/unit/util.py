@@ -0,0 +1,32 @@
+# Copyright (c) 2015 Scopely, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import os
+
+
+def get_billing_filepath(name):
+    return os.path.join(os.path.dirname(__file__), 'data', name)
+
+
+class SuperSliceAssertions(object):
+
+    # For unittest.TestCase subclasses
+
+    def assertSuperSlicesEqual(self, ss1, ss2):
+        self.assertEqual(sorted(ss1.slices), sorted(ss2.slices))
+        self.assertEqual(ss1.start, ss2.start)
+        self.assertEqual(ss1.end, ss2.end)
+        self.assertEqual(len(ss1.non_lineitems), len(ss2.non_lineitems))
+        for key in ss1.slices:
+            for metric1, metric2 in zip(ss1.slices[key].metrics,
+                                        ss2.slices[key].metrics):
+                self.assertEqual(metric1.data, metric2.data)